@@ -0,0 +1,90 @@
+"""Synthetic inputs for the benchmarks, generated locally so runs need no downloads."""
+import os
+import random
+
+import fitz
+from PIL import Image, ImageDraw, ImageFont
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+WORDS = (
+    "attention memory practice habit focus reading review chapter lesson idea example "
+    "summary question answer method result learning skill progress goal note context "
+    "pattern detail structure argument evidence principle theory model system process"
+).split()
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def paragraph(rng, sentences=6):
+    return " ".join(sentence(rng) for _ in range(sentences))
+
+
+def make_text(path, words, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        while words > 0:
+            f.write(paragraph(rng) + "\n\n")
+            words -= 72
+
+
+def make_pdf(path, pages, chapter_every=12, seed=0):
+    """A book with a large heading every ``chapter_every`` pages and ~40 body lines per page."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        y = 72
+        if page_number >= 3 and page_number % chapter_every == 3:
+            page.insert_text((72, y), f"Chapter {page_number // chapter_every + 1}: {sentence(rng, 3)}", fontsize=20)
+            y += 36
+        while y < 760:
+            page.insert_text((72, y), sentence(rng, 10), fontsize=10)
+            y += 16
+    doc.save(path)
+    doc.close()
+
+
+def make_text_image(path, lines, seed=0):
+    rng = random.Random(seed)
+    font = ImageFont.load_default(size=28)
+    image = Image.new("RGB", (1600, 80 + 44 * lines), "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(lines):
+        draw.text((40, 40 + 44 * line), sentence(rng, 8), fill="black", font=font)
+    image.save(path)
+
+
+def make_audio(path, seconds, seed=0):
+    """Tone bursts separated by pauses, so silence splitting sees speech-like segments."""
+    rng = random.Random(seed)
+    audio = AudioSegment.silent(duration=0, frame_rate=16000)
+    while len(audio) < seconds * 1000:
+        burst = Sine(rng.randint(180, 400)).to_audio_segment(duration=rng.randint(1500, 6000)) - 12
+        audio += burst + AudioSegment.silent(duration=rng.randint(600, 1200), frame_rate=16000)
+    audio[:seconds * 1000].set_channels(1).set_frame_rate(16000).export(path, format="wav")
+
+
+def build(directory):
+    """Create every fixture in ``directory``, skipping files that already exist."""
+    os.makedirs(directory, exist_ok=True)
+    makers = {
+        "pdf-50.pdf": lambda path: make_pdf(path, 50),
+        "pdf-300.pdf": lambda path: make_pdf(path, 300),
+        "pdf-800.pdf": lambda path: make_pdf(path, 800),
+        "text-5k.txt": lambda path: make_text(path, 5000),
+        "text-50k.txt": lambda path: make_text(path, 50000),
+        "image-10.png": lambda path: make_text_image(path, 10),
+        "image-60.png": lambda path: make_text_image(path, 60),
+        "audio-30s.wav": lambda path: make_audio(path, 30),
+        "audio-300s.wav": lambda path: make_audio(path, 300),
+    }
+    paths = {}
+    for name, make in makers.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            make(path)
+        paths[name] = path
+    return paths
@@ -0,0 +1,83 @@
+"""Login throughput benchmark for the bcrypt hashing executor.
+
+Runs concurrent password verifications through auth.utils the same way
+/auth/token does and reports verifications per second, per core, and the
+worst event loop stall seen while they run.
+
+    cd back && python -m benchmarks.login_throughput --rounds 10 12 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+for name in ("DATABASE_URL", "SYNC_DATABASE_URL", "REDIS_URL", "CELERY_BROKER_URL", "CELERY_RESULT_BACKEND"):
+    os.environ.setdefault(name, "unused://")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+
+async def loop_lag(stop):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        worst = max(worst, time.perf_counter() - started - 0.01)
+    return worst
+
+
+async def measure(concurrency, requests):
+    from src.auth.utils import get_password_hash, verify_password
+
+    hashed = await get_password_hash("correct horse battery staple")
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    pending = iter(range(requests))
+
+    async def client():
+        for _ in pending:
+            verified, _new_hash = await verify_password("correct horse battery staple", hashed)
+            assert verified
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return requests / elapsed, await lag
+
+
+def run_scenario(args):
+    rounds, concurrency, requests = args
+    rate, lag = asyncio.run(measure(concurrency, requests))
+    workers = int(os.environ.get("PASSWORD_HASH_WORKERS") or 0) or os.cpu_count() or 1
+    print(f"{rounds:>6} {concurrency:>11} {rate:>10.1f} {rate / workers:>12.1f} {lag * 1000:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--scenario", type=int, nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args.scenario)
+        return
+
+    print(f"{'rounds':>6} {'concurrency':>11} {'logins/s':>10} {'per worker':>12} {'max lag ms':>12}")
+    # The cost factor is read at import time, so each scenario gets a fresh interpreter
+    for rounds in args.rounds:
+        for concurrency in args.concurrency:
+            env = dict(os.environ, BCRYPT_ROUNDS=str(rounds), PASSWORD_HASH_QUEUE_SIZE=str(max(concurrency, 64)))
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.login_throughput", "--scenario", str(rounds), str(concurrency), str(args.requests)],
+                env=env,
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark the main endpoints offline and compare against a stored baseline.
+
+OpenAI, Unsplash, YouTube and Google speech are served by local stubs, see
+benchmarks/stubs.py. Postgres and Redis must be reachable through the usual
+settings, e.g. ``docker compose up -d db redis``. Fixtures are generated on
+the first run, tiktoken's encoding must already be cached (TIKTOKEN_CACHE_DIR)
+for the run to be fully offline.
+
+    cd back
+    python -m benchmarks.run                          # every scenario
+    python -m benchmarks.run extract-chapters submit/pdf --requests 50 --concurrency 8
+    python -m benchmarks.run --save-baseline          # store results as the new baseline
+
+Every request uses unique input so caches are cold, ``--warm`` repeats the same
+input to measure cache hits instead. Exits with status 1 when a scenario's
+throughput or p99 latency is worse than the baseline by more than ``--tolerance``.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from .fixtures import build
+from .scenarios import SCENARIOS
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def start_stubs(port, latencies):
+    command = [sys.executable, "-m", "benchmarks.stubs", "--port", str(port)]
+    for name, milliseconds in latencies.items():
+        command += [f"--{name}-latency", str(milliseconds)]
+    process = subprocess.Popen(command)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Stub server did not start on port {port}")
+
+
+def run_scenario(name, args, fixtures, stub_url, workdir):
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"{stub_url}/v1",
+        UNSPLASH_BASE_URL=f"{stub_url}/unsplash",
+        # Speech recognition posts to a fixed google.com URL, which only a proxy can redirect
+        http_proxy=stub_url,
+        no_proxy="127.0.0.1,localhost",
+        EXTRACTION_CACHE_DIR=os.path.join(workdir, name, "cache"),
+        UPLOAD_DIR=os.path.join(workdir, name, "uploads"),
+        SCRATCH_ROOT=os.path.join(workdir, name, "scratch"),
+    )
+    command = [
+        sys.executable, "-m", "benchmarks.scenarios", name,
+        "--fixtures", json.dumps(fixtures),
+        "--requests", str(args.requests),
+        "--concurrency", str(args.concurrency),
+        "--stub-url", stub_url,
+    ]
+    if args.warm:
+        command.append("--warm")
+    output = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(result, baseline, tolerance):
+    if baseline is None:
+        return "", "", False
+    throughput = result["throughput"] / baseline["throughput"] - 1 if baseline["throughput"] else 0.0
+    p99 = result["p99_ms"] / baseline["p99_ms"] - 1 if baseline["p99_ms"] else 0.0
+    return f"{throughput:+.0%}", f"{p99:+.0%}", throughput < -tolerance or p99 > tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help="run scenarios whose name contains any of these")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warm", action="store_true")
+    parser.add_argument("--fixtures", default="/tmp/focus-feed/benchmark-fixtures")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--openai-latency", type=float, default=300, help="milliseconds")
+    parser.add_argument("--token-latency", type=float, default=2, help="milliseconds per completion token")
+    parser.add_argument("--unsplash-latency", type=float, default=100, help="milliseconds")
+    parser.add_argument("--youtube-latency", type=float, default=200, help="milliseconds")
+    parser.add_argument("--speech-latency", type=float, default=200, help="milliseconds")
+    args = parser.parse_args()
+
+    names = [name for name in SCENARIOS if not args.scenarios or any(part in name for part in args.scenarios)]
+    fixtures = build(args.fixtures)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    stubs = start_stubs(args.port, {
+        "openai": args.openai_latency,
+        "token": args.token_latency,
+        "unsplash": args.unsplash_latency,
+        "youtube": args.youtube_latency,
+        "speech": args.speech_latency,
+    })
+    results = {}
+    regressed = False
+    print(f"{'scenario':<28} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6} {'rss MB':>8} {'req/s Δ':>8} {'p99 Δ':>7}")
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in names:
+                result = results[name] = run_scenario(name, args, fixtures, f"http://127.0.0.1:{args.port}", workdir)
+                throughput, p99, worse = compare(result, baseline.get(name), args.tolerance)
+                regressed |= worse
+                print(
+                    f"{name:<28} {result['throughput']:>8.2f} {result['p50_ms']:>9.0f} {result['p99_ms']:>9.0f} "
+                    f"{result['errors']:>6} {result['peak_rss_mb']:>8.0f} {throughput:>8} {p99:>7}"
+                    + ("  REGRESSION" if worse else "")
+                )
+    finally:
+        stubs.terminate()
+
+    if args.save_baseline:
+        config = {"requests": args.requests, "concurrency": args.concurrency, "warm": args.warm}
+        with open(args.baseline, "w") as f:
+            json.dump({"config": config, "results": {**baseline, **results}}, f, indent=2)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Benchmark scenarios, each run in its own process so peak RSS is per scenario."""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+
+
+@dataclass
+class Scenario:
+    path: str
+    fixture: str | None = None
+    auth: bool = False
+    form: dict = field(default_factory=dict)
+
+    def request(self, fixtures, nonce):
+        """httpx keyword arguments for one request, ``nonce`` makes the input unique."""
+        if self.path == "/multiformat/upload":
+            return {"data": {"url": f"https://www.youtube.com/watch?v=bench{nonce}", "contentType": "url"}}
+
+        with open(fixtures[self.fixture], "rb") as f:
+            data = f.read()
+        if self.path.startswith("/pdf/generate-video-data"):
+            words = data.decode().split()[:self.form["words"]]
+            return {"json": {"content": f"Run {nonce}\n" + " ".join(words)}}
+
+        # Trailing bytes change the digest, so extraction is not served from cache,
+        # every format used here ignores data after its end marker
+        data += f"\n% {nonce}\n".encode()
+        field_name = "files" if self.path.startswith("/multiformat/submit") else "file"
+        return {"files": [(field_name, (self.fixture, data))], "data": self.form or None}
+
+
+SCENARIOS = {
+    "extract-chapters/pdf-50": Scenario("/pdf/extract-chapters", "pdf-50.pdf"),
+    "extract-chapters/pdf-300": Scenario("/pdf/extract-chapters", "pdf-300.pdf"),
+    "extract-chapters/pdf-800": Scenario("/pdf/extract-chapters", "pdf-800.pdf"),
+    "submit/text-5k": Scenario("/multiformat/submit", "text-5k.txt", auth=True),
+    "submit/text-50k": Scenario("/multiformat/submit", "text-50k.txt", auth=True),
+    "submit/pdf-50": Scenario("/multiformat/submit", "pdf-50.pdf", auth=True),
+    "submit/image-10": Scenario("/multiformat/submit", "image-10.png", auth=True),
+    "submit/image-60": Scenario("/multiformat/submit", "image-60.png", auth=True),
+    "submit/audio-30s": Scenario("/multiformat/submit", "audio-30s.wav", auth=True),
+    "submit/audio-300s": Scenario("/multiformat/submit", "audio-300s.wav", auth=True),
+    "submit-stream/text-5k": Scenario("/multiformat/submit/stream", "text-5k.txt", auth=True),
+    "submit-stream/text-50k": Scenario("/multiformat/submit/stream", "text-50k.txt", auth=True),
+    "upload/youtube": Scenario("/multiformat/upload"),
+    "generate-video-data/1k": Scenario("/pdf/generate-video-data", "text-5k.txt", form={"words": 1000}),
+    "generate-video-data/5k": Scenario("/pdf/generate-video-data", "text-5k.txt", form={"words": 5000}),
+    "generate-video-data-stream/5k": Scenario("/pdf/generate-video-data/stream", "text-5k.txt", form={"words": 5000}),
+}
+
+
+def process_rss(pid):
+    """Resident set size of a process and all its descendants, in bytes."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        children = []
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(f.read().split())
+    except (OSError, StopIteration):
+        return 0
+    return rss + sum(process_rss(child) for child in children)
+
+
+class RssSampler(threading.Thread):
+    """Samples the RSS of this process and its pool workers, keeping the peak."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, process_rss(os.getpid()))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def use_youtube_stub(stub_url):
+    # The YouTube client libraries have no configurable endpoint, so the two
+    # functions that use them are pointed at the stub server instead
+    from src.multiformatsupport import services
+
+    def process_youtube_url(youtube_url):
+        video_id = youtube_url.split("v=")[1].split("&")[0]
+        entries = httpx.get(f"{stub_url}/youtube/transcript/{video_id}").json()
+        return [{"timestamp": services.format_time(entry["start"]), "text": entry["text"]} for entry in entries]
+
+    def get_video_details(youtube_url):
+        video_id = youtube_url.split("v=")[1].split("&")[0]
+        details = httpx.get(f"{stub_url}/youtube/details/{video_id}").json()
+        return {
+            "videoName": details["title"],
+            "authorName": details["author"],
+            "duration": services.format_time(details["length"]),
+        }
+
+    services.process_youtube_url = process_youtube_url
+    services.get_video_details = get_video_details
+
+
+async def login(client):
+    credentials = {"email": "benchmark@example.com", "password": "benchmark-password"}
+    response = await client.post("/auth/register", json=credentials)
+    if response.status_code == 400:
+        response = await client.post(
+            "/auth/token", data={"username": credentials["email"], "password": credentials["password"]}
+        )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def failed_in_body(response):
+    """Whether a successful response reports a failure in its body, as streams and per-file results do."""
+    content_type = response.headers.get("content-type", "")
+    if content_type.startswith("text/event-stream"):
+        return "event: error" in response.text
+    if content_type.startswith("application/x-ndjson"):
+        items = [json.loads(line) for line in response.text.splitlines() if line]
+    elif content_type.startswith("application/json"):
+        items = response.json()
+        items = items if isinstance(items, list) else [items]
+    else:
+        return False
+    return any(isinstance(item, dict) and "error" in item for item in items)
+
+
+async def run(name, fixtures, requests, concurrency, warm, stub_url):
+    scenario = SCENARIOS[name]
+    use_youtube_stub(stub_url)
+    from src.main import app
+
+    await app.router.startup()
+    run_id = uuid.uuid4().hex[:8]
+    latencies = []
+    errors = 0
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        headers = await login(client) if scenario.auth else {}
+
+        async def send(index):
+            nonce = run_id if warm else f"{run_id}{index}"
+            started = time.perf_counter()
+            response = await client.post(scenario.path, headers=headers, **scenario.request(fixtures, nonce))
+            elapsed = time.perf_counter() - started
+            if response.status_code < 400 and failed_in_body(response):
+                return elapsed, 500
+            return elapsed, response.status_code
+
+        # Untimed, so process pool start-up and model loading are not counted
+        await send("warmup")
+
+        pending = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for index in pending:
+                elapsed, status = await send(index)
+                latencies.append(elapsed)
+                errors += status >= 400
+
+        sampler = RssSampler()
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    await app.router.shutdown()
+    return {
+        "scenario": name,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": sampler.peak / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", choices=SCENARIOS)
+    parser.add_argument("--fixtures", required=True, help="JSON mapping of fixture names to paths")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warm", action="store_true")
+    parser.add_argument("--stub-url", required=True)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.name, json.loads(args.fixtures), args.requests, args.concurrency, args.warm, args.stub_url))
+    # The app prints to stdout too, the result is always the last line
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
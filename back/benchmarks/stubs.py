@@ -0,0 +1,260 @@
+"""Local stand-ins for the OpenAI, Unsplash, YouTube and Google speech APIs.
+
+Responses have the shape the real APIs return, after a configurable delay,
+so the app's own work is measured without network variance or API costs.
+
+    python -m benchmarks.stubs --port 9000
+
+- ``POST /v1/chat/completions``, point OPENAI_BASE_URL at ``http://host:port/v1``,
+  streamed as server-sent events when the request sets ``stream``
+- ``GET /unsplash/search/photos``, point UNSPLASH_BASE_URL at ``http://host:port/unsplash``
+- ``GET /youtube/transcript/<id>`` and ``GET /youtube/details/<id>``
+- Google speech recognition, by using this server as ``http_proxy``
+"""
+import argparse
+import json
+import math
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .fixtures import WORDS, paragraph, sentence
+
+# "token" is the time to generate each completion token, on top of "openai"
+latency = {"openai": 0.3, "token": 0.002, "unsplash": 0.1, "youtube": 0.2, "speech": 0.2}
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text.split()) * 1.3)
+
+
+def video_structure(rng, content):
+    scenes = max(3, min(30, len(content.split()) // 200))
+
+    def part(heading):
+        return {
+            "durationInSeconds": 5,
+            "content": {"heading": heading, "subheading": sentence(rng, 5)},
+            "voiceover": paragraph(rng, 2),
+            "animation": {"type": "zoom-out", "durationInSeconds": 1},
+            "style": {},
+        }
+
+    return {
+        "summary": paragraph(rng),
+        "title": sentence(rng, 4),
+        "backgroundColor": "#101820",
+        "textColor": "#f2aa4c",
+        "fontFamily": "Inter",
+        "intro": part("Intro"),
+        "scenes": [
+            {
+                "title": sentence(rng, 3),
+                "description": paragraph(rng, 2),
+                "image": "",
+                "durationInSeconds": 10,
+                "voiceover": paragraph(rng, 3),
+                "animation": {"type": "zoom-out", "durationInSeconds": 1},
+                "style": {},
+                "imageSearchKeyword": rng.choice(WORDS),
+            }
+            for _ in range(scenes)
+        ],
+        "outro": part("Outro"),
+    }
+
+
+def function_arguments(rng, name, prompt):
+    if name == "generate_video_structure":
+        return video_structure(rng, prompt)
+    if name == "generate_summary":
+        return {
+            "summary": paragraph(rng),
+            "highlights": [sentence(rng) for _ in range(5)],
+            "insights": [sentence(rng) for _ in range(3)],
+        }
+    return {}
+
+
+def json_summary(rng):
+    # Carries the keys of both the section notes and the final summary the app asks for
+    lists = {key: [sentence(rng) for _ in range(4)] for key in ("key_points", "arguments", "conclusions", "insights")}
+    return {
+        "summary": paragraph(rng, 4),
+        "overview": paragraph(rng, 4),
+        "details": lists,
+        **lists,
+        "highlight_terms": [rng.choice(WORDS) for _ in range(5)],
+    }
+
+
+def chat_completion(request):
+    prompt = " ".join(str(message.get("content") or "") for message in request.get("messages", []))
+    rng = random.Random(prompt)
+    message = {"role": "assistant", "content": None}
+    if request.get("function_call"):
+        name = request["function_call"]["name"]
+        message["function_call"] = {"name": name, "arguments": json.dumps(function_arguments(rng, name, prompt))}
+        output = message["function_call"]["arguments"]
+    elif (request.get("response_format") or {}).get("type") == "json_object":
+        message["content"] = output = json.dumps(json_summary(rng))
+    else:
+        message["content"] = output = paragraph(rng, 8)
+
+    prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(output)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "gpt-4o-mini"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def completion_chunks(completion):
+    """The chunks of a streamed completion, roughly one per token."""
+    message = completion["choices"][0]["message"]
+    chunk = {key: completion[key] for key in ("id", "created", "model")}
+    chunk["object"] = "chat.completion.chunk"
+
+    def delta(values, finish_reason=None):
+        return {**chunk, "choices": [{"index": 0, "delta": values, "finish_reason": finish_reason}]}
+
+    yield delta({"role": "assistant", "content": None})
+    output = message["function_call"]["arguments"] if message.get("function_call") else message["content"]
+    if message.get("function_call"):
+        yield delta({"function_call": {"name": message["function_call"]["name"], "arguments": ""}})
+    for start in range(0, len(output), 4):
+        piece = output[start:start + 4]
+        yield delta({"function_call": {"arguments": piece}} if message.get("function_call") else {"content": piece})
+    yield delta({}, "stop")
+    yield {**chunk, "choices": [], "usage": completion["usage"]}
+
+
+def unsplash_search(query):
+    photo_id = uuid.uuid5(uuid.NAMESPACE_URL, query).hex[:11]
+    url = f"https://images.unsplash.com/photo-{photo_id}"
+    return {
+        "total": 1,
+        "total_pages": 1,
+        "results": [{"id": photo_id, "urls": {"raw": url, "full": url, "regular": url, "small": url, "thumb": url}}],
+    }
+
+
+def youtube_transcript(video_id, entries=300):
+    rng = random.Random(video_id)
+    return [{"text": sentence(rng), "start": index * 4.0, "duration": 4.0} for index in range(entries)]
+
+
+def youtube_details(video_id):
+    rng = random.Random(video_id)
+    return {"title": sentence(rng, 5), "author": "Benchmark Channel", "length": 1200}
+
+
+def google_speech(body):
+    rng = random.Random(len(body))
+    return '{"result":[]}\n' + json.dumps({
+        "result": [{"alternative": [{"transcript": sentence(rng), "confidence": 0.9}], "final": True}],
+        "result_index": 0,
+    })
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type="application/json"):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        data = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_completion(self, completion):
+        chunks = list(completion_chunks(completion))
+        # Spread the generation time of the whole completion over its chunks
+        delay = latency["token"] * completion["usage"]["completion_tokens"] / len(chunks)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield json.dumps(chunk)
+        yield "[DONE]"
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def send_events(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in events:
+            data = f"data: {event}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/unsplash/search/photos":
+            time.sleep(latency["unsplash"])
+            self.send_body(unsplash_search(parse_qs(url.query).get("query", [""])[0]))
+        elif url.path.startswith("/youtube/transcript/"):
+            time.sleep(latency["youtube"])
+            self.send_body(youtube_transcript(url.path.rsplit("/", 1)[1]))
+        elif url.path.startswith("/youtube/details/"):
+            time.sleep(latency["youtube"])
+            self.send_body(youtube_details(url.path.rsplit("/", 1)[1]))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.read_body()
+        if url.path == "/v1/chat/completions":
+            request = json.loads(body)
+            completion = chat_completion(request)
+            time.sleep(latency["openai"])
+            if request.get("stream"):
+                self.send_events(self.stream_completion(completion))
+            else:
+                time.sleep(latency["token"] * completion["usage"]["completion_tokens"])
+                self.send_body(completion)
+        elif url.path.startswith("/speech-api/"):
+            # Reached as a proxy, the request line carries the full google.com URL
+            time.sleep(latency["speech"])
+            self.send_body(google_speech(body), "text/plain")
+        else:
+            self.send_error(404)
+
+
+def serve(port):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    for name, seconds in latency.items():
+        parser.add_argument(f"--{name}-latency", type=float, default=seconds * 1000, help="milliseconds")
+    args = parser.parse_args()
+    for name in latency:
+        latency[name] = getattr(args, f"{name}_latency") / 1000
+    serve(args.port)
+
+
+if __name__ == "__main__":
+    main()
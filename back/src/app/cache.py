@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import redis.asyncio as aioredis
+
+from .config import settings
+from .metrics import register_stats
+
+redis_client = aioredis.from_url(settings.redis_url)
+
+
+class TTLCache:
+    """In-process LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+
+class DiskLRU:
+    """Size-bounded directory of cache files, least recently used evicted first.
+
+    The directory can be shared by several processes. Reads touch a file's
+    mtime, and writes rescan the directory once the running size estimate
+    passes the bound, and at least every ``RESCAN_WRITES`` writes, so the
+    size bound and the LRU order cover the files written by all of them. In
+    between, the directory can exceed the bound by what the other processes
+    wrote since the last rescan.
+    """
+
+    # Writes between two rescans when the estimate stays under the bound
+    RESCAN_WRITES = 100
+    # Eviction leaves this share of the bound free, so a full cache is not rescanned on every write
+    EVICT_HEADROOM = 0.1
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._scan()
+
+    def _scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    files.append((entry.name, entry.stat()))
+                except FileNotFoundError:
+                    pass
+        files.sort(key=lambda file: file[1].st_mtime)
+        self._entries = OrderedDict((name, stat.st_size) for name, stat in files)
+        self._size = sum(self._entries.values())
+        self._writes = 0
+
+    def _name(self, key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _touch(self, name):
+        """Mark an entry as used, adopting files written by other processes."""
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                return True
+        try:
+            size = os.path.getsize(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._size += size
+        return True
+
+    def get(self, key):
+        name = self._name(key)
+        if not self._touch(name):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+
+    def path(self, key):
+        """Path of a cached file, for entries too large to read into memory."""
+        name = self._name(key)
+        if not self._touch(name):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._add(name, len(data))
+
+    def set_file(self, key, source):
+        """Copy a file into the cache without reading it into memory."""
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            return
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, path)
+        self._add(name, size)
+
+    def _add(self, name, size):
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._size += size
+            self._writes += 1
+            if self._size > self.max_bytes or self._writes >= self.RESCAN_WRITES:
+                # Picks up the files other processes wrote or evicted since the last scan
+                self._scan()
+            evicted = []
+            if self._size > self.max_bytes:
+                while self._size > self.max_bytes * (1 - self.EVICT_HEADROOM) and self._entries:
+                    old_name, old_size = self._entries.popitem(last=False)
+                    self._size -= old_size
+                    evicted.append(old_name)
+
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except FileNotFoundError:
+                pass
+
+
+class ExtractionCache:
+    """Two-tier cache for extracted file contents, keyed by the upload's SHA-256.
+
+    The local disk tier is checked first, then the shared Redis tier, a Redis hit
+    is copied back to disk so the next lookup on this host stays local.
+    """
+
+    def __init__(self, disk, ttl):
+        self.disk = disk
+        self.ttl = ttl
+        self.stats = Counter()
+
+    async def get(self, key):
+        data = await asyncio.to_thread(self.disk.get, key)
+        if data is not None:
+            self.stats["disk_hits"] += 1
+            return json.loads(data)
+
+        try:
+            data = await redis_client.get(key)
+        except aioredis.RedisError:
+            data = None
+        if data is not None:
+            self.stats["redis_hits"] += 1
+            await asyncio.to_thread(self.disk.set, key, data)
+            return json.loads(data)
+
+        return None
+
+    async def set(self, key, value):
+        data = json.dumps(value).encode()
+        await asyncio.to_thread(self.disk.set, key, data)
+        try:
+            await redis_client.set(key, data, ex=self.ttl)
+        except aioredis.RedisError:
+            pass
+
+    async def lookup(self, kind, digest):
+        value = await self.get(f"extract:{kind}:{digest}")
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def store(self, kind, digest, value):
+        await self.set(f"extract:{kind}:{digest}", value)
+
+    async def get_or_extract(self, kind, digest, extract):
+        value = await self.lookup(kind, digest)
+        if value is None:
+            value = await extract()
+            await self.store(kind, digest, value)
+        return value
+
+
+extraction_cache = ExtractionCache(
+    DiskLRU(settings.extraction_cache_dir, settings.extraction_cache_max_bytes),
+    settings.extraction_cache_ttl,
+)
+register_stats("extraction_cache", extraction_cache.stats, hit_ratio=True)
@@ -5,7 +5,8 @@ from .config import settings
 celery_app = Celery(
     "worker",
     broker=settings.celery_broker_url,
-    backend=settings.celery_result_backend
+    backend=settings.celery_result_backend,
+    include=[f"{__package__}.tasks"]
 )
 
-celery_app.conf.update(task_track_started=True)
+celery_app.conf.update(task_track_started=True, result_expires=settings.job_result_ttl)
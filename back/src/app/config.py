@@ -9,6 +9,70 @@ class Settings(BaseSettings):
     celery_result_backend: str
     secret_key: str
     openai_api_key: str
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    db_echo: bool = False
+    db_n_plus_one_threshold: int = 10
+    openai_base_url: str | None = None
+    openai_timeout: float = 120.0
+    openai_connect_timeout: float = 5.0
+    openai_max_connections: int = 50
+    openai_max_concurrency: int = 32
+    openai_max_concurrency_per_user: int = 4
+    openai_max_retries: int = 3
+    openai_retry_base_delay: float = 0.5
+    openai_retry_max_delay: float = 20.0
+    cpu_pool_workers: int = 0
+    cpu_pool_queue_size: int = 16
+    cpu_pool_retry_after: int = 5
+    cpu_job_timeout: float = 300.0
+    pdf_shard_pages: int = 32
+    document_store_dir: str = "/tmp/focus-feed/documents"
+    document_store_max_bytes: int = 5 * 1024 * 1024 * 1024
+    max_page_range: int = 200
+    ocr_dpi: int = 200
+    ocr_max_dimension: int = 2500
+    extraction_cache_dir: str = "/tmp/focus-feed/extraction-cache"
+    extraction_cache_max_bytes: int = 1024 * 1024 * 1024
+    extraction_cache_ttl: int = 7 * 24 * 3600
+    llm_cache_max_entries: int = 1024
+    llm_cache_ttl: int = 24 * 3600
+    summary_chunk_tokens: int = 6000
+    summary_max_input_tokens: int = 24000
+    summary_map_concurrency: int = 4
+    submit_file_concurrency: int = 4
+    unsplash_base_url: str | None = None
+    image_search_concurrency: int = 8
+    image_cache_max_entries: int = 4096
+    image_cache_ttl: int = 7 * 24 * 3600
+    upload_dir: str = "/tmp/focus-feed/uploads"
+    max_upload_bytes: int = 500 * 1024 * 1024
+    scratch_root: str = "/tmp/focus-feed/scratch"
+    transcription_segment_seconds: int = 30
+    transcription_min_silence_ms: int = 500
+    transcription_workers: int = 8
+    transcription_batch_size: int = 8
+    transcription_engine: str = "google"
+    vosk_model_path: str = "/models/vosk"
+    memory_max_turns: int = 20
+    memory_token_budget: int = 4000
+    memory_message_tokens: int = 1000
+    memory_rolling_summary: bool = True
+    memory_fold_batch: int = 10
+    memory_summary_tokens: int = 500
+    memory_ttl: int = 30 * 24 * 3600
+    profile_digest_tokens: int = 600
+    profile_digest_ttl: int = 24 * 3600
+    user_cache_max_entries: int = 10000
+    user_cache_ttl: int = 60
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 0
+    password_hash_queue_size: int = 64
+    job_upload_dir: str = "/tmp/focus-feed/jobs"
+    job_result_ttl: int = 24 * 3600
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 
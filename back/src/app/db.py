@@ -1,15 +1,64 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from .config import settings
+from .metrics import db_pool_checked_out, db_pool_checkout_seconds, db_query_seconds, record_query, sql_operation
+
+
+class CheckoutTimer:
+    engine_name = None
+
+    def _do_get(self):
+        # Covers both waiting for a free connection and opening a new one
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_seconds.labels(self.engine_name).observe(time.perf_counter() - started)
+
+
+class AsyncTimedPool(CheckoutTimer, AsyncAdaptedQueuePool):
+    engine_name = "async"
+
+
+class SyncTimedPool(CheckoutTimer, QueuePool):
+    engine_name = "sync"
+
+
+def instrument(engine, name):
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        db_query_seconds.labels(name, sql_operation(statement)).observe(time.perf_counter() - context._query_started)
+        record_query(statement)
+
+    db_pool_checked_out.labels(name).set_function(engine.pool.checkedout)
+
+
+pool_options = dict(
+    echo=settings.db_echo,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
+    pool_recycle=settings.db_pool_recycle,
+    pool_pre_ping=settings.db_pool_pre_ping,
+)
 
-async_engine = create_async_engine(settings.database_url.replace('postgresql://', 'postgresql+asyncpg://'), echo=True)
+async_engine = create_async_engine(settings.database_url.replace('postgresql://', 'postgresql+asyncpg://'), poolclass=AsyncTimedPool, **pool_options)
 AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+instrument(async_engine.sync_engine, "async")
 
 
-sync_engine = create_engine(settings.sync_database_url, echo=True)
+sync_engine = create_engine(settings.sync_database_url, poolclass=SyncTimedPool, **pool_options)
 SyncSessionLocal = sessionmaker(bind=sync_engine, autocommit=False, autoflush=False)
+instrument(sync_engine, "sync")
 
 Base = declarative_base()
 
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException, status
+
+from .config import settings
+from .metrics import cpu_job_seconds, cpu_pool_pending, cpu_queue_wait_seconds, work_processed, worker_counts
+
+_pool = None
+_pending = 0
+_lock = threading.Lock()
+_inline = False
+
+cpu_pool_pending.set_function(lambda: _pending)
+
+
+def pool_size():
+    return settings.cpu_pool_workers or os.cpu_count() or 1
+
+
+# One slot per pool process, shared by the jobs of every request
+_slots = asyncio.Semaphore(pool_size())
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=pool_size())
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _discard_pool(pool):
+    # A worker died and the pool is unusable, the next job starts a new one
+    global _pool
+    if _pool is pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def run_inline():
+    """Run jobs in the calling process, for workers that are already a pool process."""
+    global _inline
+    _inline = True
+
+
+def _timed_call(func, args, kwargs):
+    # Runs in the pool process, whose own metrics are never scraped, so timings
+    # and work counts travel back with the result
+    worker_counts.clear()
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started, time.time(), dict(worker_counts)
+
+
+def _release(_future):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def admit():
+    """Reject a new request with 429 when the pool is already behind by a full queue.
+
+    Called once per request before any of its work is started. The jobs of an
+    admitted request are never rejected, however many shards or files it has.
+    """
+    if _inline:
+        return
+    with _lock:
+        if _pending >= pool_size() + settings.cpu_pool_queue_size:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Server is busy processing other files, please retry later",
+                headers={"Retry-After": str(settings.cpu_pool_retry_after)},
+            )
+
+
+async def run_in_pool(func, *args, timeout=None, **kwargs):
+    """Run a CPU-bound function in the worker process pool.
+
+    Jobs wait for one of ``pool_size()`` slots shared by every request, so the
+    pool is never oversubscribed however many documents are split into shards
+    at once. Waiting and running jobs count towards ``admit``. A slot is only
+    freed once the job has actually finished, even if the caller timed out.
+    When a worker process dies, the jobs that were in its pool fail and the
+    pool is replaced for the following ones.
+    """
+    global _pending
+    if _inline:
+        return func(*args, **kwargs)
+
+    with _lock:
+        _pending += 1
+    submitted = time.time()
+    try:
+        await _slots.acquire()
+    except BaseException:
+        _release(None)
+        raise
+
+    loop = asyncio.get_running_loop()
+
+    def free_slot(future):
+        _release(future)
+        try:
+            loop.call_soon_threadsafe(_slots.release)
+        except RuntimeError:
+            # The loop is gone, nothing is waiting for the slot anymore
+            pass
+
+    try:
+        pool = get_pool()
+        try:
+            future = pool.submit(_timed_call, func, args, kwargs)
+        except BrokenProcessPool:
+            # Broken by a job of another request, this one has not run yet
+            _discard_pool(pool)
+            pool = get_pool()
+            future = pool.submit(_timed_call, func, args, kwargs)
+    except Exception:
+        free_slot(None)
+        raise
+    future.add_done_callback(free_slot)
+
+    try:
+        result, started, ended, counts = await asyncio.wait_for(
+            asyncio.wrap_future(future),
+            timeout=timeout or settings.cpu_job_timeout,
+        )
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Processing the file took too long",
+        )
+
+    name = getattr(func, "__name__", "unknown")
+    cpu_queue_wait_seconds.labels(name).observe(max(started - submitted, 0))
+    cpu_job_seconds.labels(name).observe(ended - started)
+    for unit, amount in counts.items():
+        work_processed.labels(unit).inc(amount)
+    return result
@@ -0,0 +1,266 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import random
+import time
+import weakref
+from collections import Counter
+
+import httpx
+import redis.asyncio as aioredis
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+from .cache import TTLCache, redis_client
+from .config import settings
+from .metrics import llm_first_token_seconds, record_tokens, register_stats, stage_timer
+
+# One pooled HTTP transport for every OpenAI call in the process. Retries are
+# handled below so they can share the concurrency limits.
+client = AsyncOpenAI(
+    api_key=settings.openai_api_key,
+    base_url=settings.openai_base_url or None,
+    max_retries=0,
+    timeout=settings.openai_timeout,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_connections,
+        ),
+        timeout=httpx.Timeout(settings.openai_timeout, connect=settings.openai_connect_timeout),
+    ),
+)
+
+_global_limit = asyncio.Semaphore(settings.openai_max_concurrency)
+_user_limits = weakref.WeakValueDictionary()
+
+completion_cache = TTLCache(settings.llm_cache_max_entries, settings.llm_cache_ttl)
+completion_stats = Counter()
+register_stats("llm_cache", completion_stats, hit_ratio=True)
+
+_inflight = {}
+
+
+def completion_key(request):
+    payload = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return "llm:" + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _user_limit(user_id):
+    limit = _user_limits.get(user_id)
+    if limit is None:
+        limit = asyncio.Semaphore(settings.openai_max_concurrency_per_user)
+        _user_limits[user_id] = limit
+    return limit
+
+
+def _retry_delay(attempt, error):
+    retry_after = None
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+    try:
+        return min(float(retry_after), settings.openai_retry_max_delay)
+    except (TypeError, ValueError):
+        # Full jitter, so clients that failed together do not retry together
+        delay = min(settings.openai_retry_base_delay * 2 ** attempt, settings.openai_retry_max_delay)
+        return random.uniform(0, delay)
+
+
+def _is_retryable(error):
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+@contextlib.asynccontextmanager
+async def _limited(user_id):
+    if user_id is None:
+        async with _global_limit:
+            yield
+    else:
+        async with _user_limit(user_id), _global_limit:
+            yield
+
+
+async def _request_completion(request, user_id):
+    attempt = 0
+    while True:
+        try:
+            async with _limited(user_id):
+                return await client.chat.completions.create(**request)
+        except (APIConnectionError, APIStatusError) as e:
+            if attempt >= settings.openai_max_retries or not _is_retryable(e):
+                raise
+            completion_stats["retries"] += 1
+            await asyncio.sleep(_retry_delay(attempt, e))
+            attempt += 1
+
+
+async def _stream_chunks(request, user_id):
+    # Only opening the stream is retried, once tokens have been relayed a
+    # failure can no longer be hidden from the caller
+    attempt = 0
+    while True:
+        async with _limited(user_id):
+            try:
+                stream = await client.chat.completions.create(
+                    **request, stream=True, stream_options={"include_usage": True}
+                )
+            except (APIConnectionError, APIStatusError) as e:
+                if attempt >= settings.openai_max_retries or not _is_retryable(e):
+                    raise
+                error = e
+            else:
+                async with stream:
+                    async for chunk in stream:
+                        yield chunk
+                return
+        completion_stats["retries"] += 1
+        await asyncio.sleep(_retry_delay(attempt, error))
+        attempt += 1
+
+
+async def close_client():
+    await client.close()
+
+
+async def _load_completion(key):
+    completion = completion_cache.get(key)
+    if completion is not None:
+        return completion
+    try:
+        data = await redis_client.get(key)
+    except aioredis.RedisError:
+        return None
+    if data is None:
+        return None
+    completion = json.loads(data)
+    completion_cache.set(key, completion)
+    return completion
+
+
+async def _store_completion(key, completion):
+    completion_cache.set(key, completion)
+    try:
+        await redis_client.set(key, json.dumps(completion), ex=settings.llm_cache_ttl)
+    except aioredis.RedisError:
+        pass
+
+
+async def _fetch_completion(key, request, user_id):
+    completion = await _load_completion(key)
+    if completion is not None:
+        completion_stats["hits"] += 1
+        return completion
+
+    completion_stats["misses"] += 1
+    with stage_timer("openai"):
+        response = await _request_completion(request, user_id)
+    record_tokens(request.get("model"), response.usage)
+    completion = response.model_dump(mode="json")
+
+    await _store_completion(key, completion)
+    return completion
+
+
+def _forget(key):
+    def callback(task):
+        _inflight.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+    return callback
+
+
+async def create_chat_completion(user_id=None, **request):
+    """Cached, deduplicated ``client.chat.completions.create``.
+
+    Identical requests (same model, messages, functions and response format) are
+    served from the completion cache. Concurrent identical requests share a single
+    upstream call, which keeps running even if the request that started it is
+    cancelled. Upstream calls are bounded globally and per ``user_id``, and
+    retried with jittered backoff on 429, 5xx and connection errors.
+    """
+    key = completion_key(request)
+
+    completion = completion_cache.get(key)
+    if completion is not None:
+        completion_stats["hits"] += 1
+        return ChatCompletion.model_validate(completion)
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_completion(key, request, user_id))
+        task.add_done_callback(_forget(key))
+        _inflight[key] = task
+    else:
+        completion_stats["coalesced"] += 1
+
+    completion = await asyncio.shield(task)
+    return ChatCompletion.model_validate(completion)
+
+
+def completion_text(completion):
+    """Text of the reply in a completion dict, or the arguments of its function call."""
+    message = completion["choices"][0]["message"]
+    if message.get("function_call"):
+        return message["function_call"]["arguments"]
+    return message["content"]
+
+
+async def stream_chat_completion(user_id=None, **request):
+    """Streaming ``create_chat_completion``, yielding the reply text as it is generated.
+
+    For a function call the text is the JSON arguments. A cached completion is
+    yielded in one piece. A streamed one is assembled and cached once it ends,
+    so later calls for the same request are served from the cache whether they
+    stream or not. Streams are not coalesced, each caller gets its own.
+    """
+    key = completion_key(request)
+    completion = await _load_completion(key)
+    if completion is not None:
+        completion_stats["hits"] += 1
+        yield completion_text(completion)
+        return
+
+    completion_stats["misses"] += 1
+    model = request.get("model")
+    parts = []
+    function_name = finish_reason = usage = None
+    response_id, created = None, int(time.time())
+    started = time.perf_counter()
+    with stage_timer("openai"):
+        async for chunk in _stream_chunks(request, user_id):
+            response_id, created, model = chunk.id, chunk.created, chunk.model
+            usage = chunk.usage or usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            delta = choice.delta
+            if delta.function_call:
+                function_name = delta.function_call.name or function_name
+                text = delta.function_call.arguments
+            else:
+                text = delta.content
+            if text:
+                if not parts:
+                    llm_first_token_seconds.labels(request.get("model")).observe(time.perf_counter() - started)
+                parts.append(text)
+                yield text
+    record_tokens(request.get("model"), usage)
+
+    message = {"role": "assistant", "content": None}
+    if function_name:
+        message["function_call"] = {"name": function_name, "arguments": "".join(parts)}
+    else:
+        message["content"] = "".join(parts)
+    await _store_completion(key, {
+        "id": response_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason or "stop"}],
+        "usage": usage.model_dump(mode="json") if usage else None,
+    })
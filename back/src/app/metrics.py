@@ -0,0 +1,168 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client import Counter as MetricCounter
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.responses import Response
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, including streaming its body",
+    ["method", "route", "status"], buckets=SLOW_BUCKETS,
+)
+http_requests_in_progress = Gauge("http_requests_in_progress", "Requests currently being handled")
+stage_seconds = Histogram(
+    "stage_duration_seconds", "Time spent in one processing stage of a request or job", ["stage"],
+    buckets=SLOW_BUCKETS,
+)
+cpu_job_seconds = Histogram(
+    "cpu_pool_job_duration_seconds", "Time a job ran in the worker process pool", ["function"],
+    buckets=SLOW_BUCKETS,
+)
+cpu_queue_wait_seconds = Histogram(
+    "cpu_pool_queue_wait_seconds", "Time a job waited for a free pool process", ["function"]
+)
+cpu_pool_pending = Gauge("cpu_pool_pending_jobs", "Jobs running or queued in the worker process pool")
+work_processed = MetricCounter("work_processed", "Work processed, by unit", ["unit"])
+llm_tokens = MetricCounter("llm_tokens", "OpenAI tokens used by upstream completions", ["model", "direction"])
+llm_first_token_seconds = Histogram(
+    "llm_first_token_seconds", "Time until a streamed completion sends its first token", ["model"],
+    buckets=SLOW_BUCKETS,
+)
+
+db_query_seconds = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ["engine", "operation"]
+)
+db_pool_checkout_seconds = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ["engine"]
+)
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out_connections", "Connections currently checked out of the pool", ["engine"]
+)
+db_request_queries = Histogram(
+    "db_queries_per_request", "SQL statements run while handling one request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+db_n_plus_one = MetricCounter(
+    "db_n_plus_one_total", "Requests that ran the same statement repeatedly", ["route"]
+)
+
+# Statements run by the current request, keyed by SQL text
+request_queries: ContextVar[Counter | None] = ContextVar("request_queries", default=None)
+
+# Work counted inside pool processes, sent back to the parent with each job's result
+worker_counts = Counter()
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+def sql_operation(statement):
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return operation if operation in SQL_OPERATIONS else "OTHER"
+
+
+def stage_timer(stage):
+    return stage_seconds.labels(stage).time()
+
+
+async def timed(stage, awaitable):
+    with stage_timer(stage):
+        return await awaitable
+
+
+def count_work(unit, amount=1):
+    work_processed.labels(unit).inc(amount)
+    worker_counts[unit] += amount
+
+
+def record_tokens(model, usage):
+    if usage is not None:
+        llm_tokens.labels(model, "in").inc(usage.prompt_tokens or 0)
+        llm_tokens.labels(model, "out").inc(usage.completion_tokens or 0)
+
+
+class StatsCollector:
+    """Exports the in-process stats Counters kept by the caches as Prometheus counters."""
+
+    def __init__(self):
+        self.stats = {}
+
+    def collect(self):
+        for name, (stats, hit_ratio) in self.stats.items():
+            events = CounterMetricFamily(f"{name}_events", f"{name} events", labels=["event"])
+            for event, value in stats.items():
+                events.add_metric([event], value)
+            yield events
+            if hit_ratio:
+                lookups = stats["hits"] + stats["misses"]
+                yield GaugeMetricFamily(
+                    f"{name}_hit_ratio", f"Share of {name} lookups served from cache",
+                    value=stats["hits"] / lookups if lookups else 0.0,
+                )
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+def register_stats(name, stats, hit_ratio=False):
+    stats_collector.stats[name] = (stats, hit_ratio)
+
+
+def record_query(statement):
+    queries = request_queries.get()
+    if queries is not None:
+        queries[statement] += 1
+
+
+def route_name(scope):
+    # FastAPI stores the matched route in the scope, its path keeps label cardinality bounded
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = Counter()
+        token = request_queries.set(queries)
+        started = time.perf_counter()
+        http_requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_progress.dec()
+            request_queries.reset(token)
+            route = route_name(scope)
+            http_request_seconds.labels(scope["method"], route, status).observe(time.perf_counter() - started)
+            db_request_queries.labels(route).observe(sum(queries.values()))
+            repeated = [(statement, count) for statement, count in queries.items() if count >= settings.db_n_plus_one_threshold]
+            if repeated:
+                db_n_plus_one.labels(route).inc()
+                for statement, count in repeated:
+                    logger.warning("Possible N+1 query on %s, ran %d times: %s", route, count, " ".join(statement.split())[:200])
+
+
+def metrics_response():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,88 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from fastapi import HTTPException, status
+
+from .config import settings
+from .metrics import count_work
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledUpload:
+    """An upload copied to its own file on disk, with its size and SHA-256."""
+
+    def __init__(self, filename, path, size, digest):
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.digest = digest
+
+    def cleanup(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _copy_upload(source, path, max_bytes):
+    digest = hashlib.sha256()
+    size = 0
+    source.seek(0)
+    with open(path, "wb") as f:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"File is larger than {max_bytes} bytes",
+                )
+            digest.update(chunk)
+            f.write(chunk)
+    return size, digest.hexdigest()
+
+
+async def spool_upload(file, directory=None):
+    """Copy an UploadFile to disk chunk by chunk, hashing it on the way.
+
+    Only one chunk is held in memory at a time, and the copy runs in a thread so
+    hashing large files does not block the event loop. The caller owns the file
+    and must call ``cleanup()`` when done with it.
+    """
+    directory = directory or settings.upload_dir
+    os.makedirs(directory, exist_ok=True)
+    extension = os.path.splitext(file.filename or "")[1]
+    fd, path = tempfile.mkstemp(suffix=extension, dir=directory)
+    os.close(fd)
+
+    try:
+        size, digest = await asyncio.to_thread(_copy_upload, file.file, path, settings.max_upload_bytes)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    count_work("upload_bytes", size)
+    return SpooledUpload(file.filename, path, size, digest)
+
+
+async def spool_uploads(files, directory=None):
+    """Spool several uploads, removing the ones already on disk if one fails."""
+    uploads = []
+    try:
+        for file in files:
+            uploads.append(await spool_upload(file, directory))
+    except BaseException:
+        for upload in uploads:
+            upload.cleanup()
+        raise
+    return uploads
+
+
+def scratch_dir():
+    """Private working directory for one job, removed with its contents on exit.
+
+    Use as ``with scratch_dir() as path:``. Lives under SCRATCH_ROOT, which can be
+    pointed at a tmpfs.
+    """
+    os.makedirs(settings.scratch_root, exist_ok=True)
+    return tempfile.TemporaryDirectory(prefix="job-", dir=settings.scratch_root)
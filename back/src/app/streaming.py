@@ -0,0 +1,112 @@
+import json
+
+from starlette.responses import StreamingResponse
+
+
+class ArrayItemParser:
+    """Incremental parser for a streamed JSON object, such as function call arguments.
+
+    ``feed`` returns the items of the top-level array ``key`` that were closed
+    by the new text, each parsed as soon as its closing bracket arrives.
+    Top-level string and number values seen so far are kept in ``fields``.
+    The text is assumed to be a single valid JSON object.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.fields = {}
+        self.text = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.token_start = None
+        self.last_key = None
+        self.expecting_key = False
+        self.in_array = False
+        self.item_start = None
+
+    def _close_token(self, end):
+        value = json.loads(self.text[self.token_start:end])
+        self.token_start = None
+        if self.expecting_key:
+            self.last_key = value
+        else:
+            self.fields[self.last_key] = value
+
+    def feed(self, text):
+        self.text += text
+        items = []
+        while self.position < len(self.text):
+            index = self.position
+            char = self.text[index]
+            self.position += 1
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.token_start is not None:
+                        self._close_token(index + 1)
+                continue
+
+            if self.token_start is not None and char in ",} \t\r\n":
+                # End of a top-level number, true, false or null
+                self._close_token(index)
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    self.token_start = index
+            elif char in "{[":
+                if self.depth == 1 and char == "[" and self.last_key == self.key:
+                    self.in_array = True
+                elif self.in_array and self.depth == 2:
+                    self.item_start = index
+                self.depth += 1
+                if self.depth == 1:
+                    self.expecting_key = True
+            elif char in "}]":
+                self.depth -= 1
+                if self.in_array and self.depth == 2 and self.item_start is not None:
+                    items.append(json.loads(self.text[self.item_start:index + 1]))
+                    self.item_start = None
+                elif self.in_array and self.depth == 1:
+                    self.in_array = False
+            elif self.depth == 1:
+                if char == ":":
+                    self.expecting_key = False
+                elif char == ",":
+                    self.expecting_key = True
+                elif not char.isspace() and self.token_start is None:
+                    self.token_start = index
+        return items
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _sse_events(events):
+    try:
+        async for event, data in events:
+            yield sse_event(event, data)
+    except Exception as e:
+        # The status line is long gone, failures are reported in the stream
+        yield sse_event("error", {"detail": str(e)})
+        return
+    yield sse_event("done", {})
+
+
+def sse_response(events, background=None):
+    """Server-sent events response for an async iterator of ``(event, data)``, ending with ``done`` or ``error``."""
+    return StreamingResponse(
+        _sse_events(events),
+        media_type="text/event-stream",
+        # Proxies must pass tokens through as they arrive
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background,
+    )
@@ -1,6 +1,80 @@
+import asyncio
+import os
+
+from celery.signals import worker_process_init
+
+from ..multiformatsupport.memory import ConversationMemory
+from ..multiformatsupport.services import (summarize_upload,
+                                           summarize_with_openai_and_memory)
+from ..pdf.api import build_video_data, extract_chapter_list
 from .celery import celery_app
+from .executor import run_inline
+
+_loop = None
+
+
+@worker_process_init.connect
+def setup_worker_process(**kwargs):
+    # Prefork children are daemonic and cannot start a process pool of their own,
+    # the worker process already is the unit of CPU parallelism.
+    run_inline()
+
+
+def run_async(coro):
+    # One loop per worker process, so pooled clients and semaphores stay bound to it
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+def progress_reporter(task):
+    def report(stage, **info):
+        task.update_state(state="PROGRESS", meta={"stage": stage, **info})
+    return report
+
+
+def remove_job_uploads(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
 
 
 @celery_app.task
 def add(x, y):
     return x + y
+
+
+@celery_app.task(bind=True, name="pdf.extract_chapters")
+def extract_chapters(self, path, digest):
+    try:
+        progress_reporter(self)("extract")
+        chapters = run_async(extract_chapter_list(path, digest))
+        return {"chapters": chapters}
+    finally:
+        remove_job_uploads([path])
+
+
+@celery_app.task(bind=True, name="pdf.generate_video_data")
+def generate_video_data(self, content):
+    return run_async(build_video_data(content, progress_reporter(self)))
+
+
+@celery_app.task(bind=True, name="multiformat.submit")
+def submit_files(self, uploads, profile, user_id):
+    report = progress_reporter(self)
+    memory = ConversationMemory(user_id)
+    try:
+        return [
+            run_async(summarize_upload(filename, path, digest, profile, memory, user_id, report))
+            for filename, path, digest in uploads
+        ]
+    finally:
+        remove_job_uploads([path for _, path, _ in uploads])
+
+
+@celery_app.task(bind=True, name="multiformat.upload")
+def summarize_youtube(self, url, user_id):
+    return run_async(summarize_with_openai_and_memory(
+        url, ConversationMemory(user_id), user_id, report=progress_reporter(self)
+    ))
@@ -8,7 +8,8 @@ from sqlalchemy.future import select
 
 from ..app.db import get_async_db
 from ..app.models import User
-from .dependencies import get_current_user
+from ..app.schema import User as UserIdentity
+from .dependencies import get_current_user, invalidate_user_cache
 from .schemas import Token
 from .utils import create_access_token, get_password_hash, verify_password
 
@@ -26,12 +27,17 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     result = await db.execute(query)
     user = result.scalars().first()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    verified, new_hash = (await verify_password(form_data.password, user.hashed_password)) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     
     access_token_expires = timedelta(minutes=30)
     access_token = create_access_token(
@@ -53,15 +59,16 @@ async def register_user(credentials: UserCredentials = Body(...), db: AsyncSessi
             detail="Email already registered",
         )
 
-    hashed_password = get_password_hash(credentials.password)
+    hashed_password = await get_password_hash(credentials.password)
     new_user = User(email=credentials.email, hashed_password=hashed_password)
     db.add(new_user)
     await db.commit()
+    await invalidate_user_cache(new_user.email)
 
     access_token = create_access_token(data={"sub": new_user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.get("/me")
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: UserIdentity = Depends(get_current_user)):
     return current_user
\ No newline at end of file
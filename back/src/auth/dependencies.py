@@ -1,14 +1,63 @@
+import redis.asyncio as aioredis
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy.orm import joinedload
 
+from ..app.cache import TTLCache, redis_client
+from ..app.config import settings
 from ..app.db import get_async_db
 from ..app.models import User
+from ..app.schema import User as UserIdentity
 from .utils import decode_access_token
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
+
+user_cache = TTLCache(settings.user_cache_max_entries, settings.user_cache_ttl)
+
+
+async def invalidate_user_cache(email: str):
+    key = f"user:{email}"
+    user_cache.pop(key)
+    try:
+        await redis_client.delete(key)
+    except aioredis.RedisError:
+        pass
+
+
+async def load_user_identity(db: AsyncSession, email: str) -> UserIdentity | None:
+    """Resolve a user's id and email, from the in-process cache, then Redis, then the DB.
+
+    Only the identity columns are selected, related data such as quiz summaries
+    is loaded by the endpoints that need it.
+    """
+    key = f"user:{email}"
+    identity = user_cache.get(key)
+    if identity is not None:
+        return identity
+
+    try:
+        cached = await redis_client.get(key)
+    except aioredis.RedisError:
+        cached = None
+    if cached is not None:
+        identity = UserIdentity.model_validate_json(cached)
+        user_cache.set(key, identity)
+        return identity
+
+    result = await db.execute(select(User.id, User.email).where(User.email == email))
+    row = result.first()
+    if row is None:
+        return None
+
+    identity = UserIdentity(id=row.id, email=row.email)
+    user_cache.set(key, identity)
+    try:
+        await redis_client.set(key, identity.model_dump_json(), ex=settings.user_cache_ttl)
+    except aioredis.RedisError:
+        pass
+    return identity
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
@@ -19,17 +68,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
-    query = select(User).options(joinedload(User.summaries)).where(User.email == email)
-    result = await db.execute(query)
-    user = result.scalars().first()
-    
-    print(user)
 
+    user = await load_user_identity(db, email)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
\ No newline at end of file
+    return user
+
+
+async def get_optional_user(token: str | None = Depends(optional_oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    if token is None:
+        return None
+    return await get_current_user(token, db)
@@ -1,11 +1,28 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+from fastapi import HTTPException, status
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from ..app.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min and max rounds to the configured cost makes any hash with a
+# different cost "need update", so it is rehashed on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+    bcrypt__max_rounds=settings.bcrypt_rounds,
+)
+
+# bcrypt releases the GIL while hashing, so threads are enough to keep it off the event loop
+_hash_workers = settings.password_hash_workers or os.cpu_count() or 1
+_hash_pool = ThreadPoolExecutor(max_workers=_hash_workers, thread_name_prefix="bcrypt")
+_hash_slots = asyncio.Semaphore(_hash_workers + settings.password_hash_queue_size)
 
 
 SECRET_KEY = settings.secret_key
@@ -13,12 +30,25 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def run_hashing(func, *args):
+    """Run a bcrypt operation on the hashing threads, rejecting it with 429 when the queue is full."""
+    if _hash_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts in progress, please retry later",
+            headers={"Retry-After": str(settings.cpu_pool_retry_after)},
+        )
+    async with _hash_slots:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, func, *args)
+
+
+async def verify_password(plain_password, hashed_password):
+    """Return whether the password matches, and a new hash if the stored one uses an outdated cost."""
+    return await run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await run_hashing(pwd_context.hash, password)
 
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
@@ -0,0 +1,49 @@
+from celery.result import AsyncResult
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+
+from ..app.celery import celery_app
+from ..app.schema import User as UserIdentity
+from ..auth.dependencies import get_current_user
+from .services import is_job_owner
+
+router = APIRouter()
+
+
+async def owned_job(job_id: str, current_user: UserIdentity = Depends(get_current_user)):
+    # Other users' jobs are reported as missing, so job ids cannot be probed
+    if not await is_job_owner(job_id, current_user.id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job_id
+
+
+# Plain `def` endpoints: reading the result backend is blocking I/O, so FastAPI
+# runs these in its threadpool.
+@router.get("/{job_id}")
+def job_status(job_id: str = Depends(owned_job)):
+    result = AsyncResult(job_id, app=celery_app)
+    response = {"job_id": job_id, "state": result.state}
+
+    if result.state == "PROGRESS":
+        response["progress"] = result.info
+    elif result.state == "SUCCESS":
+        response["result_url"] = f"/jobs/{job_id}/result"
+    elif result.state == "FAILURE":
+        response["error"] = str(result.result)
+
+    return response
+
+
+@router.get("/{job_id}/result")
+def job_result(job_id: str = Depends(owned_job)):
+    result = AsyncResult(job_id, app=celery_app)
+
+    if result.state == "SUCCESS":
+        return result.result
+    if result.state == "FAILURE":
+        raise HTTPException(status_code=500, detail=str(result.result))
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"job_id": job_id, "state": result.state},
+    )
@@ -0,0 +1,41 @@
+import uuid
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+
+from ..app.cache import redis_client
+from ..app.celery import celery_app
+from ..app.config import settings
+
+
+def owner_key(job_id):
+    return f"job:{job_id}:owner"
+
+
+def job_owner(current_user):
+    """Id of the user a background job is run for, only signed-in users can start one."""
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Sign in to run background jobs",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return current_user.id
+
+
+async def enqueue_job(task_name, owner_id, *args):
+    # Uploads are passed by path inside JOB_UPLOAD_DIR, a directory shared with
+    # the workers, so file contents never travel through the broker.
+    job_id = str(uuid.uuid4())
+    # The owner is recorded first, so a job never runs without one
+    await redis_client.set(owner_key(job_id), owner_id, ex=settings.job_result_ttl)
+    celery_app.send_task(task_name, args=args, task_id=job_id)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"job_id": job_id, "status_url": f"/jobs/{job_id}"},
+    )
+
+
+async def is_job_owner(job_id, user_id):
+    owner = await redis_client.get(owner_key(job_id))
+    return owner is not None and int(owner) == user_id
@@ -8,9 +8,13 @@ from sqlalchemy import text
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .app.config import settings
+from .app.cache import extraction_cache, redis_client
 from .app.db import Base, async_engine, get_async_db
+from .app.executor import shutdown_pool
+from .app.llm import close_client, completion_stats
+from .app.metrics import MetricsMiddleware, metrics_response
 from .auth.auth import router as auth_router
+from .jobs.api import router as jobs_router
 from .multiformatsupport.api import router as multiformat_router
 from .pdf.api import router as pdf_router
 from .quiz.api import router as quiz_router
@@ -25,9 +29,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-redis_client = aioredis.from_url(settings.redis_url)
-
+app.add_middleware(MetricsMiddleware)
 
 @app.on_event("startup")
 async def startup():
@@ -35,6 +37,12 @@ async def startup():
         await conn.run_sync(Base.metadata.create_all)
 
 
+@app.on_event("shutdown")
+async def shutdown():
+    shutdown_pool()
+    await close_client()
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -52,6 +60,32 @@ async def check_health(db: AsyncSession = Depends(get_async_db)):
         raise HTTPException(status_code=500, detail="Redis connection failed")
 
     return {"status": "ok", "database": "connected", "redis": "connected"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = extraction_cache.stats
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        "extraction": {
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "disk_hits": stats["disk_hits"],
+            "redis_hits": stats["redis_hits"],
+            "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+        },
+        "llm": {
+            "hits": completion_stats["hits"],
+            "misses": completion_stats["misses"],
+            "coalesced": completion_stats["coalesced"],
+            "retries": completion_stats["retries"],
+        },
+    }
   
 app.include_router(pdf_router, prefix="/pdf", tags=["pdf"])
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
@@ -59,4 +93,5 @@ app.include_router(auth_router, prefix="/auth", tags=["auth"])
 app.include_router(multiformat_router, prefix="/multiformat")
 
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
-app.include_router(quiz_router, prefix="/quiz", tags=["quiz"])
\ No newline at end of file
+app.include_router(quiz_router, prefix="/quiz", tags=["quiz"])
+app.include_router(jobs_router, prefix="/jobs", tags=["jobs"])
\ No newline at end of file
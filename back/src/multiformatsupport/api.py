@@ -1,14 +1,23 @@
+import json
 from typing import List, Optional
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.background import BackgroundTask
 
+from ..app.config import settings
 from ..app.db import get_async_db
-from ..app.models import User
-from ..auth.dependencies import get_current_user
+from ..app.executor import admit
+from ..app.schema import User as UserIdentity
+from ..app.storage import spool_uploads
+from ..app.streaming import sse_response
+from ..auth.dependencies import get_current_user, get_optional_user
+from ..jobs.services import enqueue_job, job_owner
+from ..quiz.services import get_profile_digest
 from .memory import get_memory
-from .services import (process_file, summarize_with_openai_and_memory,
-                       summarize_with_openai_and_memory_files)
+from .services import (stream_upload_summaries, summarize_uploads,
+                       summarize_with_openai_and_memory, transcription_stats)
 
 router = APIRouter()
 
@@ -17,31 +26,63 @@ router = APIRouter()
 async def submit(
     files: List[UploadFile] = File(None),
     youtube_url: str = Form(None),
+    background: bool = False,
+    stream: bool = False,
     memory = Depends(get_memory),
-    current_user: User = Depends(get_current_user),
+    current_user: UserIdentity = Depends(get_current_user),
     db: AsyncSession = Depends(get_async_db)
 ):
-    results = []
+    # Retrieve the user's precomputed profile instead of every quiz summary
+    profile = await get_profile_digest(db, current_user.id)
 
-    # Retrieve the user's quiz summaries
-    quiz_summaries = current_user.summaries
-    combined_quiz_summary = "\n\n".join([summary.summary_text for summary in quiz_summaries])
+    if background:
+        uploads = await spool_uploads(files or [], settings.job_upload_dir)
+        return await enqueue_job(
+            "multiformat.submit",
+            current_user.id,
+            [(upload.filename, upload.path, upload.digest) for upload in uploads],
+            profile,
+            current_user.id,
+        )
 
-    # Process files
-    if files:
-        for file in files:
-            content = await file.read()
-            processed_text = await process_file(file.filename, content)
+    # Every file is on disk before the first result is sent, then they are
+    # extracted and summarized concurrently
+    admit()
+    uploads = await spool_uploads(files or [])
+    results = summarize_uploads(uploads, profile, memory, current_user.id)
 
-            # Combine the user's quiz summaries with the processed file content
-            combined_text = f"{combined_quiz_summary}\n\n{processed_text}"
-            summary = summarize_with_openai_and_memory_files(combined_text, memory)
-            results.append({
-                "filename": file.filename,
-                "summary": summary
-            })
+    if stream:
+        # One JSON object per line, in the order the files finish
+        async def stream_results():
+            async for index, result in results:
+                yield json.dumps({"index": index, **result}) + "\n"
 
-    return results
+        return StreamingResponse(
+            stream_results(),
+            media_type="application/x-ndjson",
+            background=BackgroundTask(lambda: [upload.cleanup() for upload in uploads]),
+        )
+
+    ordered = sorted([item async for item in results], key=lambda item: item[0])
+    return [result for _, result in ordered]
+
+
+@router.post("/submit/stream")
+async def submit_stream(
+    files: List[UploadFile] = File(...),
+    memory = Depends(get_memory),
+    current_user: UserIdentity = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Server-sent events with every summary token as it is generated, unlike
+    # /submit?stream=true which sends each file's result once it is complete
+    profile = await get_profile_digest(db, current_user.id)
+    admit()
+    uploads = await spool_uploads(files)
+    return sse_response(
+        stream_upload_summaries(uploads, profile, memory, current_user.id),
+        background=BackgroundTask(lambda: [upload.cleanup() for upload in uploads]),
+    )
 
 
 @router.post("/upload")
@@ -49,13 +90,29 @@ async def process_youtube(
     url: str = Form(...),
     contentType: str = Form(...),
     files: Optional[List[UploadFile]] = File(None),  # Make files optional
-    memory = Depends(get_memory)
+    background: bool = False,
+    memory = Depends(get_memory),
+    current_user: UserIdentity | None = Depends(get_optional_user)
 ):
     if contentType == "url" and "youtube.com/watch" in url:
+        if background:
+            return await enqueue_job("multiformat.upload", job_owner(current_user), url, memory.user_id)
         try:
-            video_summary = summarize_with_openai_and_memory(url, memory)
+            video_summary = await summarize_with_openai_and_memory(url, memory, memory.user_id)
             return video_summary
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to process video: {str(e)}")
     else:
-        raise HTTPException(status_code=400, detail="Invalid content type or YouTube URL")
\ No newline at end of file
+        raise HTTPException(status_code=400, detail="Invalid content type or YouTube URL")
+
+
+@router.get("/transcription/stats")
+async def transcription_statistics():
+    audio_seconds = transcription_stats["audio_seconds"]
+    return {
+        "engine": settings.transcription_engine,
+        "segments": transcription_stats["segments"],
+        "audio_seconds": audio_seconds,
+        "processing_seconds": transcription_stats["processing_seconds"],
+        "real_time_factor": transcription_stats["processing_seconds"] / audio_seconds if audio_seconds else None,
+    }
@@ -0,0 +1,81 @@
+import hashlib
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    # Tokenizer used by gpt-4o-mini, loaded on first use. The docker image
+    # ships it in TIKTOKEN_CACHE_DIR, elsewhere tiktoken may have to download it
+    return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def clip_tokens(text, max_tokens):
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def _split_long_paragraph(paragraph, max_tokens):
+    encoding = get_encoding()
+    tokens = encoding.encode(paragraph, disallowed_special=())
+    for start in range(0, len(tokens), max_tokens):
+        piece = encoding.decode(tokens[start:start + max_tokens])
+        yield piece, count_tokens(piece)
+
+
+def _is_boundary(paragraph):
+    return hashlib.blake2b(paragraph.encode(), digest_size=1).digest()[0] % 8 == 0
+
+
+def chunk_text(text, max_tokens, min_tokens=None):
+    """Split text on line boundaries into chunks of at most ``max_tokens`` tokens.
+
+    Once a chunk holds ``min_tokens`` it is closed after any line whose hash hits a
+    fixed pattern, so boundaries depend on content rather than offsets. Editing one
+    section then only changes that chunk and leaves the others (and their cached
+    summaries) intact.
+    """
+    if min_tokens is None:
+        min_tokens = max_tokens // 2
+
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for paragraph in text.splitlines():
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        tokens = count_tokens(paragraph)
+        if tokens > max_tokens:
+            pieces = _split_long_paragraph(paragraph, max_tokens)
+        else:
+            pieces = [(paragraph, tokens)]
+
+        for piece, piece_tokens in pieces:
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+
+            current.append(piece)
+            current_tokens += piece_tokens
+
+            if current_tokens >= min_tokens and _is_boundary(piece):
+                chunks.append("\n".join(current))
+                current = []
+                current_tokens = 0
+
+    if current:
+        chunks.append("\n".join(current))
+
+    return chunks
@@ -1,5 +1,198 @@
-from langchain.memory import ConversationBufferMemory
+import asyncio
+import json
+import logging
 
+import redis.asyncio as aioredis
+from fastapi import Depends
 
-def get_memory():
-    return ConversationBufferMemory(return_messages=True)
+from ..app.cache import redis_client
+from ..app.config import settings
+from ..app.llm import create_chat_completion
+from ..app.schema import User as UserIdentity
+from ..auth.dependencies import get_optional_user
+from .chunking import clip_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# A fold holding the lock longer than this is assumed dead
+FOLD_LOCK_TIMEOUT = 300
+
+# Folds run after the request that triggered them has returned
+_folds = set()
+
+
+def make_turn(user_message, ai_message):
+    # Stored messages are clipped, a whole book must not become one turn of history
+    user_message = clip_tokens(user_message, settings.memory_message_tokens)
+    ai_message = clip_tokens(ai_message, settings.memory_message_tokens)
+    return {
+        "user": user_message,
+        "assistant": ai_message,
+        "tokens": count_tokens(user_message) + count_tokens(ai_message),
+    }
+
+
+class ConversationMemory:
+    """Per-user conversation history kept in Redis.
+
+    Turns are appended to a Redis list, and loading reads only the newest
+    ``memory_max_turns`` of them, so neither grows with the length of the
+    history. Once ``memory_fold_batch`` older turns have piled up they are
+    folded into a rolling summary in the background, one LLM call per batch.
+    Anonymous callers (``user_id`` None) get no history.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.turns_key = f"memory:{user_id}:turns"
+        self.summary_key = f"memory:{user_id}:summary"
+        self.fold_lock_key = f"memory:{user_id}:fold-lock"
+
+    async def load_messages(self):
+        """Chat messages for the newest turns that fit in ``memory_token_budget``."""
+        if self.user_id is None:
+            return []
+
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(self.summary_key)
+                pipe.lrange(self.turns_key, -settings.memory_max_turns, -1)
+                summary, turns = await pipe.execute()
+        except aioredis.RedisError:
+            return []
+
+        messages = []
+        budget = settings.memory_token_budget
+        for raw_turn in reversed(turns):
+            turn = json.loads(raw_turn)
+            if turn["tokens"] > budget:
+                break
+            budget -= turn["tokens"]
+            messages[:0] = [
+                {"role": "user", "content": turn["user"]},
+                {"role": "assistant", "content": turn["assistant"]},
+            ]
+
+        if summary:
+            messages.insert(0, {
+                "role": "system",
+                "content": f"Summary of the earlier conversation with this user:\n{summary.decode()}"
+            })
+        return messages
+
+    async def append(self, user_message, ai_message):
+        if self.user_id is None:
+            return
+
+        # The user message can be a whole book, tokenizing it would stall the event loop
+        await self.push(await asyncio.to_thread(make_turn, user_message, ai_message))
+
+    async def push(self, turn):
+        """Append a turn built by ``make_turn``."""
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.rpush(self.turns_key, json.dumps(turn))
+                if not settings.memory_rolling_summary:
+                    # Older turns are dropped right away, with a rolling summary only folding removes them
+                    pipe.ltrim(self.turns_key, -settings.memory_max_turns, -1)
+                pipe.expire(self.turns_key, settings.memory_ttl)
+                length = (await pipe.execute())[0]
+        except aioredis.RedisError:
+            return
+
+        if settings.memory_rolling_summary and length - settings.memory_max_turns >= settings.memory_fold_batch:
+            task = asyncio.ensure_future(self.fold_overflow())
+            _folds.add(task)
+            task.add_done_callback(_folds.discard)
+
+    async def fold_overflow(self):
+        """Fold turns older than the newest ``memory_max_turns`` into the summary, a batch at a time.
+
+        A Redis lock makes sure only one fold per user runs at a time, across
+        processes, so no fold overwrites the summary written by another. Only
+        the fold removes turns from the head of the list, and only once the
+        summary including them has been stored.
+        """
+        batch = settings.memory_fold_batch
+        lock = redis_client.lock(self.fold_lock_key, timeout=FOLD_LOCK_TIMEOUT)
+        try:
+            if not await lock.acquire(blocking=False):
+                return
+            try:
+                while await redis_client.llen(self.turns_key) - settings.memory_max_turns >= batch:
+                    raw_turns = await redis_client.lrange(self.turns_key, 0, batch - 1)
+                    await self.fold_into_summary([json.loads(raw_turn) for raw_turn in raw_turns])
+                    await redis_client.ltrim(self.turns_key, batch, -1)
+            finally:
+                await lock.release()
+        except Exception:
+            logger.exception("Could not fold conversation memory of user %s", self.user_id)
+
+    async def fold_into_summary(self, turns):
+        summary = await redis_client.get(self.summary_key)
+        conversation = "\n\n".join(
+            f"User: {turn['user']}\nAssistant: {turn['assistant']}" for turn in turns
+        )
+        messages = [
+            {
+                "role": "system",
+                "content": "You maintain a short running summary of a user's past requests and the answers they received. Keep what helps answer future requests: topics, preferences and key conclusions."
+            },
+            {
+                "role": "user",
+                "content": f"Current summary:\n{summary.decode() if summary else '(empty)'}\n\nNew exchanges to fold in:\n{conversation}\n\nReturn the updated summary only, in at most {settings.memory_summary_tokens // 2} words."
+            }
+        ]
+
+        response = await create_chat_completion(
+            user_id=self.user_id,
+            model="gpt-4o-mini",
+            messages=messages,
+        )
+        new_summary = clip_tokens(response.choices[0].message.content.strip(), settings.memory_summary_tokens)
+        await redis_client.set(self.summary_key, new_summary, ex=settings.memory_ttl)
+
+
+class RequestMemory:
+    """One request's view of a ConversationMemory, for files summarized concurrently.
+
+    The history is loaded once and every file is summarized against it. The
+    turns of the files are held back and appended in file order by ``flush``,
+    once the whole batch has finished.
+    """
+
+    def __init__(self, memory, messages):
+        self.memory = memory
+        self.messages = messages
+        self.turns = {}
+
+    @classmethod
+    async def load(cls, memory):
+        return cls(memory, await memory.load_messages())
+
+    def file(self, index):
+        """Memory to pass to the summary of the ``index``-th file."""
+        return FileMemory(self, index)
+
+    async def flush(self):
+        for index in sorted(self.turns):
+            await self.memory.push(self.turns.pop(index))
+
+
+class FileMemory:
+    def __init__(self, request, index):
+        self.request = request
+        self.index = index
+
+    async def load_messages(self):
+        return list(self.request.messages)
+
+    async def append(self, user_message, ai_message):
+        if self.request.memory.user_id is None:
+            return
+        # Only the clipped turn is kept until the batch is flushed, not the whole text
+        self.request.turns[self.index] = await asyncio.to_thread(make_turn, user_message, ai_message)
+
+
+def get_memory(current_user: UserIdentity | None = Depends(get_optional_user)):
+    return ConversationMemory(current_user.id if current_user else None)
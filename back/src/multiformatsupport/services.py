@@ -1,104 +1,309 @@
-import io
+import asyncio
 import json
 import mimetypes
 import os
 import subprocess
+import time
+import wave
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 
-import PyPDF2
-import pytesseract
 import speech_recognition as sr
-from langchain.schema import AIMessage, HumanMessage
-from openai import OpenAI
-from PIL import Image
+from fastapi import HTTPException
 from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
 from pytube import YouTube
 from youtube_transcript_api import YouTubeTranscriptApi
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
+from ..app.cache import extraction_cache
+from ..app.config import settings
+from ..app.executor import pool_size, run_in_pool
+from ..app.llm import create_chat_completion, stream_chat_completion
+from ..app.metrics import count_work, register_stats, stage_timer, timed
+from ..app.storage import scratch_dir
+from ..pdf.engine import extract_text
+from ..pdf.ocr import ocr_image
+from .chunking import chunk_text, count_tokens
+from .memory import RequestMemory
 
 AudioSegment.converter = "ffmpeg"
 AudioSegment.ffmpeg = "ffmpeg"
 AudioSegment.ffprobe = "ffprobe"
 
+# Bump when an extractor's output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = 4
 
-async def process_file(filename, content):
+
+# Real-time factor of transcription is processing_seconds / audio_seconds
+transcription_stats = Counter()
+register_stats("transcription", transcription_stats)
+
+
+class ExtractionError(Exception):
+    pass
+
+
+async def process_file(filename, path, digest):
+    extracted = await extract_file(filename, path, digest)
+    return extracted["text"]
+
+
+async def extract_file(filename, path, digest):
+    """Extract a file's text, plus a timecoded transcript for audio and video."""
     mime_type, _ = mimetypes.guess_type(filename)
     
     if mime_type == 'application/pdf':
-        return process_pdf(content)
+        kind, extract = 'pdf', lambda: timed("pdf_parse", process_pdf(path))
     elif mime_type in ['audio/mpeg', 'audio/mp3'] or (mime_type and mime_type.startswith('audio/')):
-        return process_audio(content, mime_type)
+        kind, extract = 'audio', lambda: process_audio(path)
     elif mime_type and mime_type.startswith('video/'):
-        return process_video(content)
+        kind, extract = 'video', lambda: process_video(path)
     elif mime_type and mime_type.startswith('text/'):
-        return content.decode('utf-8')
+        return {"text": await asyncio.to_thread(read_text, path)}
     elif mime_type and mime_type.startswith('image/'):
-        return process_image(content)
+        kind, extract = 'image', lambda: timed("ocr", run_in_pool(process_image, path))
     else:
         raise ValueError(f"Unsupported file type: {mime_type}")
 
+    try:
+        extracted = await extraction_cache.get_or_extract(
+            f"{kind}:v{EXTRACTOR_VERSION}",
+            digest,
+            extract,
+        )
+    except ExtractionError as e:
+        # Failures are reported as the file's text, like before, but never cached
+        return {"text": str(e)}
+
+    if kind in ('audio', 'video'):
+        return {
+            "text": "\n".join(entry['text'] for entry in extracted),
+            "transcript": extracted
+        }
+    return {"text": extracted}
 
-def process_pdf(content):
-    pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
 
+def read_text(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
 
-def process_audio(content, mime_type):
-    try:
-        format = mime_type.split('/')[-1] if mime_type else 'raw'
-        input_path = '/tmp/input_audio'
-        output_path = '/tmp/output_audio.wav'
 
-        with open(input_path, 'wb') as f:
-            f.write(content)
+async def process_pdf(path):
+    return await extract_text(path)
 
-        result = subprocess.run(
-            ['ffmpeg', '-y', '-i', input_path, '-f', 'wav', output_path],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
 
-        if result.returncode != 0:
-            print("FFmpeg failed with the following error output:")
-            print(result.stderr.decode())
-            return "Failed to decode audio file"
+def plan_segments(audio):
+    """Split decoded audio on silence into (start_ms, end_ms) segments.
+
+    Neighbouring stretches of speech are merged while they fit in one segment,
+    speech longer than a segment is cut at the maximum length.
+    """
+    if audio.dBFS == float('-inf'):
+        return []
+
+    max_ms = settings.transcription_segment_seconds * 1000
+    speech = detect_nonsilent(
+        audio,
+        min_silence_len=settings.transcription_min_silence_ms,
+        silence_thresh=audio.dBFS - 16,
+        seek_step=50
+    )
+
+    segments = []
+    for start, end in speech:
+        while end - start > max_ms:
+            segments.append([start, start + max_ms])
+            start += max_ms
+        if segments and end - segments[-1][0] <= max_ms:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    return segments
+
+
+class TranscriptionEngine(ABC):
+    """Speech-to-text backend, turns 16 kHz mono WAV segment files into text.
 
-        with open(output_path, 'rb') as wav_file:
-            audio = wav_file.read()
-            recognizer = sr.Recognizer()
-            with sr.AudioFile(io.BytesIO(audio)) as source:
-                audio_data = recognizer.record(source)
+    One engine is created per worker process and reused for every batch, so
+    backends with a local model only load it once.
+    """
 
+    name = None
+
+    @abstractmethod
+    def transcribe_batch(self, paths):
+        """Return one text per segment, None where no speech was recognised."""
+
+
+class GoogleTranscriptionEngine(TranscriptionEngine):
+    name = "google"
+
+    def transcribe_segment(self, path):
+        recognizer = sr.Recognizer()
+        with sr.AudioFile(path) as source:
+            audio_data = recognizer.record(source)
+        return recognizer.recognize_google(audio_data)
+
+    def transcribe_batch(self, paths):
+        errors = []
+
+        def transcribe(path):
             try:
-                return recognizer.recognize_google(audio_data)
+                return self.transcribe_segment(path)
             except sr.UnknownValueError:
-                return "Audio could not be understood"
+                return None
             except sr.RequestError as e:
-                return f"Could not request results from the speech recognition service: {e}"
+                errors.append(e)
+                return None
+
+        # Remote calls are I/O bound, so the batch is sent concurrently
+        with ThreadPoolExecutor(max_workers=settings.transcription_workers) as pool:
+            texts = list(pool.map(transcribe, paths))
 
+        # A failed segment only leaves a gap, the batch fails if nothing was transcribed
+        if errors and not any(texts):
+            raise ExtractionError(f"Could not request results from the speech recognition service: {errors[0]}")
+        return texts
+
+
+class VoskTranscriptionEngine(TranscriptionEngine):
+    """Offline CPU recognizer, needs a Vosk model unpacked at VOSK_MODEL_PATH."""
+
+    name = "vosk"
+
+    def __init__(self, model_path):
+        # Only needed when this engine is configured
+        from vosk import KaldiRecognizer, Model, SetLogLevel
+
+        SetLogLevel(-1)
+        self.recognizer_class = KaldiRecognizer
+        self.model = Model(model_path)
+
+    def transcribe_segment(self, path):
+        with wave.open(path, 'rb') as wav:
+            recognizer = self.recognizer_class(self.model, wav.getframerate())
+            while data := wav.readframes(8000):
+                recognizer.AcceptWaveform(data)
+        return json.loads(recognizer.FinalResult()).get('text') or None
+
+    def transcribe_batch(self, paths):
+        return [self.transcribe_segment(path) for path in paths]
+
+
+_transcription_engine = None
+
+
+def get_transcription_engine():
+    global _transcription_engine
+    if _transcription_engine is None:
+        if settings.transcription_engine == "vosk":
+            _transcription_engine = VoskTranscriptionEngine(settings.vosk_model_path)
+        elif settings.transcription_engine == "google":
+            _transcription_engine = GoogleTranscriptionEngine()
+        else:
+            raise ValueError(f"Unknown transcription engine: {settings.transcription_engine}")
+    return _transcription_engine
+
+
+def segment_duration(path):
+    with wave.open(path, 'rb') as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+def transcribe_batch(paths):
+    started = time.perf_counter()
+    texts = get_transcription_engine().transcribe_batch(paths)
+    return {
+        "texts": texts,
+        "audio_seconds": sum(segment_duration(path) for path in paths),
+        "processing_seconds": time.perf_counter() - started,
+    }
+
+
+def prepare_audio(input_path, workdir):
+    """Decode an upload once and cut it into segment files inside ``workdir``."""
+    output_path = os.path.join(workdir, 'audio.wav')
+    try:
+        # Decode once to 16 kHz mono, which is all speech recognition needs.
+        # ffmpeg reads the spooled upload directly, it is never loaded into memory.
+        result = subprocess.run(
+            ['ffmpeg', '-y', '-i', input_path, '-ac', '1', '-ar', '16000', '-f', 'wav', output_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        if result.returncode != 0:
+            print("FFmpeg failed with the following error output:")
+            print(result.stderr.decode())
+            raise ExtractionError("Failed to decode audio file")
+
+        audio = AudioSegment.from_wav(output_path)
+        segments = []
+        for index, (start, end) in enumerate(plan_segments(audio)):
+            segment_path = os.path.join(workdir, f'segment-{index}.wav')
+            audio[start:end].export(segment_path, format='wav')
+            segments.append((start, segment_path))
+        os.remove(output_path)
+        return segments
+
+    except ExtractionError:
+        raise
     except Exception as e:
         print(f"Failed to process audio: {e}")
-        return f"Failed to process audio: {e}"
-
-    finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        raise ExtractionError(f"Failed to process audio: {e}")
+
+
+async def process_audio(input_path):
+    # Each job gets its own scratch directory, so concurrent uploads never share paths
+    with scratch_dir() as workdir:
+        segments = await timed("ffmpeg", run_in_pool(prepare_audio, input_path, workdir))
+
+        # Batches go to separate pool workers, each keeping its engine warm, so
+        # one long recording is transcribed on several cores at once. Only one
+        # batch per pool worker is submitted at a time, as map_pages does with
+        # shards, so a long recording never fills the queue other requests
+        # are admitted against
+        batch_size = settings.transcription_batch_size
+        batches = [segments[i:i + batch_size] for i in range(0, len(segments), batch_size)]
+        limit = asyncio.Semaphore(pool_size())
+
+        async def transcribe(batch):
+            async with limit:
+                return await run_in_pool(transcribe_batch, [path for _, path in batch])
+
+        with stage_timer("transcription"):
+            results = await asyncio.gather(*(transcribe(batch) for batch in batches))
+
+    texts = []
+    for result in results:
+        texts.extend(result["texts"])
+        transcription_stats["segments"] += len(result["texts"])
+        transcription_stats["audio_seconds"] += result["audio_seconds"]
+        transcription_stats["processing_seconds"] += result["processing_seconds"]
+        count_work("audio_seconds", result["audio_seconds"])
+
+    # Same shape as the YouTube transcript
+    transcript = [
+        {
+            'timestamp': format_time(start / 1000),
+            'text': text
+        }
+        for (start, _), text in zip(segments, texts)
+        if text
+    ]
+    if not transcript:
+        raise ExtractionError("Audio could not be understood")
+    return transcript
 
 
-def process_video(content):
-    return process_audio(content, 'audio/mp4')
+async def process_video(path):
+    return await process_audio(path)
 
 
-def process_image(content):
-    image = Image.open(io.BytesIO(content))
-    text = pytesseract.image_to_string(image)
+def process_image(path):
+    text = ocr_image(path)
+    count_work("ocr_images")
     return text if text.strip() else "No text could be extracted from the image"
 
 
@@ -136,7 +341,61 @@ def get_video_details(youtube_url: str) -> Dict[str, str]:
     return video_details
 
 
-def summarize_with_openai_and_memory_files(text, memory):
+async def summarize_chunk(chunk, user_id=None):
+    # Only the chunk itself goes into the prompt, so the completion cache also
+    # serves as a per-chunk summary cache across documents and users.
+    messages = [
+        {
+            "role": "system",
+            "content": "You are an AI assistant that condenses one section of a longer text into structured notes. Preserve every key point, argument, conclusion, insight and important term of the section."
+        },
+        {
+            "role": "user",
+            "content": f"""Summarize the following section as a JSON object with the keys "summary" (a few paragraphs), "key_points", "arguments", "conclusions", "insights" and "highlight_terms" (each a list of strings):
+
+{chunk}"""
+        }
+    ]
+
+    response = await create_chat_completion(
+        user_id=user_id,
+        model="gpt-4o-mini",
+        messages=messages,
+        response_format={"type": "json_object"}
+    )
+
+    return json.loads(response.choices[0].message.content)
+
+
+async def condense_text(text, user_id=None):
+    """Map-reduce a long text down to section notes that fit in a single prompt.
+
+    Chunks are summarized concurrently, bounded by ``summary_map_concurrency``. If the
+    notes are still too long they are condensed again the same way.
+    """
+    limit = asyncio.Semaphore(settings.summary_map_concurrency)
+
+    async def summarize(chunk):
+        async with limit:
+            return await summarize_chunk(chunk, user_id)
+
+    # Tokenizing a whole book takes a while, tiktoken releases the GIL so it runs in a thread
+    chunks = await asyncio.to_thread(chunk_text, text, settings.summary_chunk_tokens)
+    notes = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+    condensed = "\n\n".join(json.dumps(note, ensure_ascii=False) for note in notes)
+
+    if len(chunks) > 1 and await asyncio.to_thread(count_tokens, condensed) > settings.summary_max_input_tokens:
+        return await condense_text(condensed, user_id)
+    return condensed
+
+
+async def summary_request(text, memory, user_id=None, profile=None):
+    source = "the following text"
+    prompt_text = text
+    if await asyncio.to_thread(count_tokens, text) > settings.summary_max_input_tokens:
+        source = "a long text, given below as JSON notes on its consecutive sections"
+        prompt_text = await condense_text(text, user_id)
+
     messages = [
         {
             "role": "system",
@@ -144,9 +403,9 @@ def summarize_with_openai_and_memory_files(text, memory):
         },
         {
             "role": "user",
-            "content": f"""Please provide in text language a comprehensive summary of the following text in JSON format:
+            "content": f"""Please provide in text language a comprehensive summary of {source} in JSON format:
 
-{text}
+{prompt_text}
 
 The summary should be structured as follows:
 {{
@@ -164,28 +423,171 @@ Ensure that all major aspects of the text are covered and the essence of the ori
         }
     ]
 
-    for message in memory.chat_memory.messages:
-        if isinstance(message, HumanMessage):
-            messages.append({"role": "user", "content": message.content})
-        elif isinstance(message, AIMessage):
-            messages.append({"role": "assistant", "content": message.content})
+    # Earlier turns go between the system prompt and the new request
+    messages[1:1] = await memory.load_messages()
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        response_format={"type": "json_object"}
-    )
+    # The reader profile is passed apart from the text so it never changes how
+    # the text itself is chunked and cached
+    if profile:
+        messages.insert(1, {"role": "system", "content": f"Profile of the reader, built from their quiz results. Tailor the summary to it:\n{profile}"})
+
+    return {
+        "model": "gpt-4o-mini",
+        "messages": messages,
+        "response_format": {"type": "json_object"},
+    }
+
+
+async def summarize_with_openai_and_memory_files(text, memory, user_id=None, profile=None):
+    request = await summary_request(text, memory, user_id, profile)
+    response = await create_chat_completion(user_id=user_id, **request)
 
     summary = response.choices[0].message.content.strip()
-    memory.chat_memory.add_user_message(text)
-    memory.chat_memory.add_ai_message(summary)
+    await memory.append(text, summary)
 
     return summary
 
 
-def summarize_with_openai_and_memory(youtube_url: str, memory) -> Dict[str, any]:
-    transcript_with_timecodes = process_youtube_url(youtube_url)
+async def stream_summary_files(text, memory, user_id=None, profile=None):
+    """``summarize_with_openai_and_memory_files``, yielding the summary as it is generated."""
+    request = await summary_request(text, memory, user_id, profile)
+    parts = []
+    async for part in stream_chat_completion(user_id=user_id, **request):
+        parts.append(part)
+        yield part
+    await memory.append(text, "".join(parts).strip())
+
+
+async def summarize_upload(filename, path, digest, profile, memory, user_id=None, report=None):
+    if report:
+        report("extract", filename=filename)
+    extracted = await extract_file(filename, path, digest)
+
+    if report:
+        report("summarize", filename=filename)
+    summary = await summarize_with_openai_and_memory_files(extracted['text'], memory, user_id, profile)
+
+    result = {
+        "filename": filename,
+        "summary": summary
+    }
+    if extracted.get("transcript"):
+        result["transcript"] = extracted["transcript"]
+    return result
+
+
+async def stream_upload_summary(filename, path, digest, profile, memory, user_id=None):
+    """Yield ``("token", ...)`` for each piece of the summary, then ``("result", ...)`` as returned by summarize_upload."""
+    extracted = await extract_file(filename, path, digest)
+
+    parts = []
+    async for part in stream_summary_files(extracted['text'], memory, user_id, profile):
+        parts.append(part)
+        yield "token", {"filename": filename, "text": part}
+
+    result = {
+        "filename": filename,
+        "summary": "".join(parts).strip()
+    }
+    if extracted.get("transcript"):
+        result["transcript"] = extracted["transcript"]
+    yield "result", result
+
+
+def upload_error(upload, error):
+    detail = error.detail if isinstance(error, HTTPException) else str(error)
+    return {"filename": upload.filename, "error": detail}
+
+
+async def summarize_uploads(uploads, profile, memory, user_id=None):
+    """Summarize spooled uploads concurrently, yielding ``(index, result)`` as each one finishes.
+
+    At most SUBMIT_FILE_CONCURRENCY files are processed at once. A file that
+    fails yields an ``error`` entry instead of failing the others. Every upload
+    is cleaned up once the generator is exhausted or closed. All files are
+    summarized against the history as it was before the request, their turns
+    are appended in file order once every file has finished.
+    """
+    limit = asyncio.Semaphore(settings.submit_file_concurrency)
+    history = await RequestMemory.load(memory)
+
+    async def summarize(index, upload):
+        async with limit:
+            try:
+                result = await summarize_upload(
+                    upload.filename, upload.path, upload.digest, profile, history.file(index), user_id
+                )
+            except Exception as e:
+                result = upload_error(upload, e)
+            finally:
+                upload.cleanup()
+        return index, result
+
+    tasks = [asyncio.ensure_future(summarize(index, upload)) for index, upload in enumerate(uploads)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+        await history.flush()
+    finally:
+        for task in tasks:
+            task.cancel()
+        for upload in uploads:
+            upload.cleanup()
+
+
+async def stream_upload_summaries(uploads, profile, memory, user_id=None):
+    """Stream the summaries of spooled uploads, yielding ``(event, data)`` with the file's ``index`` in ``data``.
+
+    Files are processed concurrently as in summarize_uploads, so the tokens of
+    different files are interleaved. Each file ends with a ``result`` or an
+    ``error`` event. Conversation memory is shared as in summarize_uploads.
+    """
+    limit = asyncio.Semaphore(settings.submit_file_concurrency)
+    events = asyncio.Queue()
+    history = await RequestMemory.load(memory)
+
+    async def summarize(index, upload):
+        try:
+            async with limit:
+                async for event, data in stream_upload_summary(
+                    upload.filename, upload.path, upload.digest, profile, history.file(index), user_id
+                ):
+                    events.put_nowait((event, {"index": index, **data}))
+        except Exception as e:
+            events.put_nowait(("error", {"index": index, **upload_error(upload, e)}))
+        finally:
+            upload.cleanup()
+            events.put_nowait(None)
+
+    tasks = [asyncio.ensure_future(summarize(index, upload)) for index, upload in enumerate(uploads)]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await events.get()
+            if item is None:
+                remaining -= 1
+            else:
+                yield item
+        await history.flush()
+    finally:
+        for task in tasks:
+            task.cancel()
+        for upload in uploads:
+            upload.cleanup()
+
+
+async def summarize_with_openai_and_memory(youtube_url: str, memory, user_id=None, report=None) -> Dict[str, any]:
+    if report:
+        report("extract")
+    transcript_with_timecodes = await asyncio.to_thread(process_youtube_url, youtube_url)
     transcript_text = "\n".join([entry['text'] for entry in transcript_with_timecodes])
+
+    if report:
+        report("summarize")
+    prompt_text = transcript_text
+    if await asyncio.to_thread(count_tokens, transcript_text) > settings.summary_max_input_tokens:
+        prompt_text = await condense_text(transcript_text, user_id)
+
     messages = [
         {"role": "system", "content": (
             "You are an advanced language model and assistant capable of analyzing, summarizing, and extracting key information from text. "
@@ -195,14 +597,11 @@ def summarize_with_openai_and_memory(youtube_url: str, memory) -> Dict[str, any]
             "using bullet points or numbered lists where appropriate to organize the information. Please also ensure that any technical jargon "
             "is explained or simplified to make the content accessible to a broad audience."
         )},
-        {"role": "user", "content": f"Please summarize the following text:\n\n{transcript_text}"}
+        {"role": "user", "content": f"Please summarize the following text:\n\n{prompt_text}"}
     ]
     
-    for message in memory.chat_memory.messages:
-        if isinstance(message, HumanMessage):
-            messages.append({"role": "user", "content": message.content})
-        elif isinstance(message, AIMessage):
-            messages.append({"role": "assistant", "content": message.content})
+    # Earlier turns go between the system prompt and the new request
+    messages[1:1] = await memory.load_messages()
 
     functions = [
         {
@@ -237,7 +636,8 @@ def summarize_with_openai_and_memory(youtube_url: str, memory) -> Dict[str, any]
     ]
 
     # Request a completion from the model with function calling
-    response = client.chat.completions.create(
+    response = await create_chat_completion(
+        user_id=user_id,
         model="gpt-4o-mini",
         messages=messages,
         functions=functions,
@@ -255,10 +655,9 @@ def summarize_with_openai_and_memory(youtube_url: str, memory) -> Dict[str, any]
             highlights = result.get('highlights', [])
             insights = result.get('insights', [])
 
-    memory.chat_memory.add_user_message(transcript_text)
-    memory.chat_memory.add_ai_message(summary)
+    await memory.append(transcript_text, summary)
 
-    video_details = get_video_details(youtube_url)
+    video_details = await asyncio.to_thread(get_video_details, youtube_url)
 
     url_embed = f"https://www.youtube.com/embed/{youtube_url.split('v=')[1].split('&')[0]}"
 
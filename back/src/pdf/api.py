@@ -1,35 +1,48 @@
+import asyncio
 import json
-import os
 import re
 from typing import Dict, List
 
-import fitz
-from fastapi import APIRouter, File, HTTPException, UploadFile
-from openai import OpenAI
+from fastapi import APIRouter, Depends, File, HTTPException, Path, Query, UploadFile, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from unsplash.api import Api
-from unsplash.auth import Auth
+from starlette.background import BackgroundTask
+
+from ..app.cache import extraction_cache
+from ..app.config import settings
+from ..app.executor import admit, run_in_pool
+from ..app.llm import create_chat_completion, stream_chat_completion
+from ..app.metrics import timed
+from ..app.schema import User as UserIdentity
+from ..app.storage import spool_upload
+from ..app.streaming import ArrayItemParser, sse_response
+from ..auth.dependencies import get_optional_user
+from ..jobs.services import enqueue_job, job_owner
+from .documents import document_page_count, document_path, page_range_text, store_document
+from .engine import extract_spans_range, font_scan, iter_page_text, page_count, read_toc
+from .images import find_image, find_images
 
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
 
-unsplash_auth = Auth(
-    os.environ.get("UNSPLASH_ACCESS_KEY"),
-    os.environ.get("UNSPLASH_SECRET_KEY"),
-    os.environ.get("UNSPLASH_REDIRECT_URI")
-)
-unsplash_api = Api(unsplash_auth)
+router = APIRouter()
 
+# Bump when chapter detection changes so stale cache entries are ignored
+CHAPTER_EXTRACTOR_VERSION = 3
 
-router = APIRouter()
+# Chapter headings are set at least this much larger than body text
+HEADING_SIZE_RATIO = 1.3
+# Smallest heading the keyword heuristic accepts, for documents without a clear heading size
+MIN_HEURISTIC_HEADING_SIZE = 16
+MIN_CHAPTERS = 2
+MAX_HEADING_LENGTH = 200
+
+DIGEST_PATTERN = r"^[0-9a-f]{64}$"
 
 def is_potential_chapter_heading(text, font_size, page_number):
     # Example heuristic checks:
     if page_number <= 2:  # Exclude first few pages
         return False
 
-    if font_size < 16:  # Example font size threshold
+    if font_size < MIN_HEURISTIC_HEADING_SIZE:
         return False
 
     if any(keyword in text.lower() for keyword in ["chapter", "part", "section", "prologue", "epilogue"]):
@@ -41,68 +54,288 @@ def is_potential_chapter_heading(text, font_size, page_number):
 
     return False
 
-def extract_chapter_contents(doc, chapters):
-    for i in range(len(chapters)):
-        start_page = chapters[i]["page"] - 1  # Page numbering in `fitz` starts from 0
-        end_page = chapters[i + 1]["page"] - 1 if i + 1 < len(chapters) else len(doc) - 1
-
-        content = ""
-        for page_num in range(start_page, end_page + 1):
-            page = doc[page_num]
-            blocks = page.get_text("dict")["blocks"]
-            for block in blocks:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        text = span["text"].strip()
-                        if text != chapters[i]["header"]:  # Exclude the header itself
-                            content += text + " "
-
-        chapters[i]["content"] = content.strip()
-
-    return chapters
-
-def identify_chapter_headers(pdf_bytes):
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    chapters = []
-
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        blocks = page.get_text("dict")["blocks"]
-
-        for block in blocks:
-            for line in block["lines"]:
-                for span in line["spans"]:
-                    text = span["text"].strip()
-                    font_size = span["size"]
-                    bbox = line["bbox"]
-
-                    if is_potential_chapter_heading(text, font_size, page_num + 1):
-                        chapters.append({
-                            "page": page_num + 1,
-                            "header": text,
-                            "font_size": font_size,
-                            "bbox": bbox
-                        })
-
-    # Extract content for each chapter
-    chapters = extract_chapter_contents(doc, chapters)
-
-    return chapters
+def chapter_heading_size(characters, pages):
+    """Font size of chapter headings, from the document's font-size histogram.
+
+    Body text is the size most characters are set in. Chapter headings use the
+    largest size that is clearly bigger than that and appears on several pages.
+    None when the document has no such size.
+    """
+    if not characters:
+        return None
+
+    body_size = characters.most_common(1)[0][0]
+    return max(
+        (size for size in characters if size >= body_size * HEADING_SIZE_RATIO and pages[size] >= MIN_CHAPTERS),
+        default=None,
+    )
+
+
+def min_heading_size(heading_size):
+    # Smallest span size is_chapter_heading can accept, spans are compared rounded to 0.1
+    return heading_size - 0.05 if heading_size is not None else MIN_HEURISTIC_HEADING_SIZE
+
+
+def is_chapter_heading(text, font_size, page_number, heading_size):
+    if heading_size is None:
+        return is_potential_chapter_heading(text, font_size, page_number)
+    return page_number > 2 and bool(text) and len(text) <= MAX_HEADING_LENGTH and round(font_size, 1) == heading_size
+
+
+async def assemble_chapters(spans, heading_size):
+    # Headings and chapter bodies are built from the same walk over the spans,
+    # a chapter is yielded as soon as the next heading closes it.
+    chapter = None
+    content = []
+
+    async for page_number, text, font_size, bbox in spans:
+        if is_chapter_heading(text, font_size, page_number, heading_size):
+            if chapter is not None and not content and chapter["page"] == page_number and chapter["bbox"] == bbox:
+                # Another span of the same heading line
+                chapter["header"] += " " + text
+                continue
+            if chapter is not None:
+                chapter["content"] = " ".join(content)
+                yield chapter
+            chapter = {
+                "page": page_number,
+                "header": text,
+                "font_size": font_size,
+                "bbox": bbox
+            }
+            content = []
+        elif chapter is not None and text and text != chapter["header"]:
+            content.append(text)
+
+    if chapter is not None:
+        chapter["content"] = " ".join(content)
+        yield chapter
+
+
+async def iter_shard_spans(shards):
+    for spans in shards:
+        for span in spans:
+            yield span
+
+
+async def heading_spans(path):
+    """Heading size of the document and the spans that can be headings, each page parsed once.
+
+    A shard whose own most common size is larger than the body size of the
+    whole document kept too few spans, only its pages are parsed again.
+    """
+    characters, pages, shards = await font_scan(path, HEADING_SIZE_RATIO, MIN_HEURISTIC_HEADING_SIZE)
+    heading_size = chapter_heading_size(characters, pages)
+    min_size = min_heading_size(heading_size)
+
+    async def shard_spans(start, stop, shard_min_size, spans):
+        if shard_min_size > min_size:
+            return await run_in_pool(extract_spans_range, path, start, stop, min_size)
+        return [span for span in spans if span[2] >= min_size]
+
+    shards = await asyncio.gather(*(shard_spans(*shard) for shard in shards))
+    return heading_size, iter_shard_spans(shards)
+
+
+async def toc_chapters(toc, pages):
+    # Each page's text goes to the last outline entry starting on or before it
+    chapter = None
+    content = []
+    entries = iter(toc)
+    entry = next(entries, None)
+    page_number = 0
+
+    async for text in pages:
+        page_number += 1
+        while entry is not None and entry[1] <= page_number:
+            if chapter is not None:
+                chapter["content"] = " ".join(content)
+                yield chapter
+            title, page = entry
+            chapter = {"page": page, "header": title, "font_size": None, "bbox": None}
+            content = []
+            entry = next(entries, None)
+        if chapter is not None:
+            content.append(" ".join(text.split()))
+
+    if chapter is not None:
+        chapter["content"] = " ".join(content)
+        yield chapter
+
+
+async def iter_chapters(path):
+    # The embedded outline names the chapters without parsing any page, only
+    # their text is needed then. Page ranges are parsed in parallel by the PDF
+    # engine and arrive in order.
+    toc = await asyncio.to_thread(read_toc, path)
+    if len(toc) >= MIN_CHAPTERS:
+        async for chapter in toc_chapters(toc, iter_page_text(path)):
+            yield chapter
+        return
+
+    # Otherwise headings are found from the font-size histogram. The pass that
+    # counts it keeps the spans too, so every page is parsed once, and the
+    # chapters are assembled from them once the whole histogram is known
+    characters, pages, shards = await font_scan(path)
+    spans = iter_shard_spans([spans for _, _, _, spans in shards])
+    async for chapter in assemble_chapters(spans, chapter_heading_size(characters, pages)):
+        yield chapter
+
+
+async def identify_chapter_headers(path):
+    return [chapter async for chapter in iter_chapters(path)]
+
+
+async def extract_chapter_list(path, digest):
+    return await extraction_cache.get_or_extract(
+        f"chapters:v{CHAPTER_EXTRACTOR_VERSION}",
+        digest,
+        lambda: timed("pdf_parse", identify_chapter_headers(path)),
+    )
+
+
+async def identify_headers(path):
+    """Chapter list without content, from the outline when there is one.
+
+    Without an outline every page is parsed once, and only the spans large
+    enough to be headings are sent back from the pool workers with the
+    font-size histogram.
+    """
+    pages = await asyncio.to_thread(page_count, path)
+    toc = await asyncio.to_thread(read_toc, path)
+    if len(toc) >= MIN_CHAPTERS:
+        chapters = [
+            {"page": page, "header": title, "font_size": None, "bbox": None}
+            for title, page in toc
+            if page <= pages
+        ]
+    else:
+        heading_size, spans = await heading_spans(path)
+        chapters = [
+            {key: value for key, value in chapter.items() if key != "content"}
+            async for chapter in assemble_chapters(spans, heading_size)
+        ]
+
+    # A chapter's content runs up to the page before the next chapter starts
+    for index, chapter in enumerate(chapters):
+        next_page = chapters[index + 1]["page"] if index + 1 < len(chapters) else pages + 1
+        chapter["index"] = index
+        chapter["end_page"] = max(chapter["page"], next_page - 1)
+    return {"pages": pages, "chapters": chapters}
+
+
+async def extract_chapter_headers(path, digest):
+    return await extraction_cache.get_or_extract(
+        f"headers:v{CHAPTER_EXTRACTOR_VERSION}",
+        digest,
+        lambda: timed("pdf_parse", identify_headers(path)),
+    )
+
+
+async def stream_chapters(chapters):
+    if isinstance(chapters, list):
+        for chapter in chapters:
+            yield json.dumps(chapter) + "\n"
+        return
+    # The status line is already sent, a failure can only be reported in the body
+    try:
+        async for chapter in chapters:
+            yield json.dumps(chapter) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+
 
 @router.post("/extract-chapters")
-async def extract_chapters(file: UploadFile = File(...)):
+async def extract_chapters(
+    file: UploadFile = File(...),
+    stream: bool = False,
+    background: bool = False,
+    headers_only: bool = False,
+    current_user: UserIdentity | None = Depends(get_optional_user)
+):
+    if background and not headers_only:
+        owner_id = job_owner(current_user)
+        upload = await spool_upload(file, settings.job_upload_dir)
+        return await enqueue_job("pdf.extract_chapters", owner_id, upload.path, upload.digest)
+
+    # Spool the uploaded PDF file to disk
+    admit()
+    upload = await spool_upload(file)
+    streaming = False
     try:
-        # Read the uploaded PDF file
-        pdf_bytes = await file.read()
+        if headers_only:
+            # Chapter contents are fetched later through /documents/{digest}
+            await store_document(upload)
+            headers = await extract_chapter_headers(upload.path, upload.digest)
+            return {"document": upload.digest, **headers}
+
+        if stream:
+            chapters = await extraction_cache.lookup(f"chapters:v{CHAPTER_EXTRACTOR_VERSION}", upload.digest)
+            if chapters is None:
+                # Fail before the response starts if the upload is not a readable PDF
+                try:
+                    await asyncio.to_thread(page_count, upload.path)
+                except Exception:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The file is not a readable PDF")
+                chapters = iter_chapters(upload.path)
+            # One JSON object per line, sent as soon as each chapter is closed.
+            # The spooled file is removed once the response has been sent.
+            streaming = True
+            return StreamingResponse(
+                stream_chapters(chapters),
+                media_type="application/x-ndjson",
+                background=BackgroundTask(upload.cleanup),
+            )
 
         # Identify chapter headers and their corresponding content
-        chapters = identify_chapter_headers(pdf_bytes)
+        chapters = await extract_chapter_list(upload.path, upload.digest)
 
         return {"chapters": chapters}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if not streaming:
+            upload.cleanup()
     
+
+@router.get("/documents/{digest}/chapters/{index}")
+async def get_chapter(digest: str = Path(..., pattern=DIGEST_PATTERN), index: int = Path(..., ge=0)):
+    admit()
+    headers = await extraction_cache.lookup(f"headers:v{CHAPTER_EXTRACTOR_VERSION}", digest)
+    if headers is None:
+        headers = await extract_chapter_headers(await document_path(digest), digest)
+
+    if index >= len(headers["chapters"]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chapter not found")
+    chapter = headers["chapters"][index]
+    content = await page_range_text(digest, chapter["page"], chapter["end_page"])
+    return {**chapter, "content": content}
+
+
+@router.get("/documents/{digest}/pages")
+async def get_pages(
+    digest: str = Path(..., pattern=DIGEST_PATTERN),
+    start: int = Query(1, ge=1),
+    end: int | None = Query(None, ge=1)
+):
+    pages = await document_page_count(digest)
+    end = min(end or start + settings.max_page_range - 1, pages)
+    if start > end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"The document has {pages} pages")
+    if end - start + 1 > settings.max_page_range:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.max_page_range} pages can be fetched at once",
+        )
+
+    admit()
+    content = await page_range_text(digest, start, end)
+    return {"document": digest, "start": start, "end": end, "content": content}
+
+
 class BookContent(BaseModel):
     content: str
 
@@ -116,20 +349,17 @@ class VideoData(BaseModel):
     scenes: List[Dict]
     outro: Dict
     
-def search_image(query):
-    try:
-        results = unsplash_api.search.photos(query, per_page=1)
-        if results and results['results']:
-            return results['results'][0].urls.regular
-    except Exception as e:
-        print(f"Error searching for image: {e}")
-    return None
-
-@router.post("/generate-video-data", response_model=VideoData)
-async def generate_video_data(book_content: BookContent):
+def image_query(video_data, scene):
+    return (
+        scene.get('imageSearchKeyword')
+        or scene.get('imageSearchKeywords')
+        or f"{video_data['title']} {scene['title']}"
+    )
+
+def video_structure_request(content):
     messages = [
         {"role": "system", "content": prompt},
-        {"role": "user", "content": f"Generate a video structure for the following book content:\n\n{book_content.content}"}
+        {"role": "user", "content": f"Generate a video structure for the following book content:\n\n{content}"}
     ]
 
     functions = [
@@ -184,7 +414,7 @@ async def generate_video_data(book_content: BookContent):
                                     }
                                 },
                                 "style": {"type": "object"},
-                                "imageSearchKeywords": {"type": "string"}  
+                                "imageSearchKeyword": {"type": "string"}
                             }
                         }
                     },
@@ -216,31 +446,107 @@ async def generate_video_data(book_content: BookContent):
         }
     ]
 
+    return {
+        "model": "gpt-4o-mini",
+        "messages": messages,
+        "functions": functions,
+        "function_call": {"name": "generate_video_structure"},
+    }
+
+
+async def build_video_data(content, report=None):
+    if report:
+        report("summarize")
+    response = await create_chat_completion(**video_structure_request(content))
+
+    function_call = response.choices[0].message.function_call
+    if not (function_call and function_call.arguments):
+        raise ValueError("Failed to generate video data")
+    video_data = json.loads(function_call.arguments)
+
+    # Resolve every scene's image concurrently instead of one request per scene
+    if report:
+        report("images")
+    queries = [image_query(video_data, scene) for scene in video_data['scenes']]
+    image_urls = await find_images(queries)
+    for scene, query in zip(video_data['scenes'], queries):
+        if image_urls[query]:
+            scene['image'] = image_urls[query]
+
+    return video_data
+
+
+async def stream_video_data(content):
+    """Yield ``(event, data)`` while the video structure is generated.
+
+    ``token`` relays each piece of the function call arguments, ``scene`` sends
+    each scene with its image, in order, and ``video`` the whole structure at
+    the end. A scene's image search starts as soon as the scene is closed in the
+    streamed JSON, while the following scenes are still being generated.
+    """
+    parser = ArrayItemParser("scenes")
+    scenes = []
+    sent = 0
+
+    def add_scene(scene):
+        # Scenes without a keyword fall back to the video title, which may not have been generated yet
+        has_query = scene.get('imageSearchKeyword') or scene.get('imageSearchKeywords') or 'title' in parser.fields
+        lookup = asyncio.ensure_future(find_image(image_query(parser.fields, scene))) if has_query else None
+        scenes.append([scene, lookup])
+
+    async def scene_event(index):
+        scene, lookup = scenes[index]
+        image_url = await lookup
+        if image_url:
+            scene['image'] = image_url
+        return {"index": index, **scene}
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini", 
-            messages=messages,
-            functions=functions,
-            function_call={"name": "generate_video_structure"}
-        )
+        async for text in stream_chat_completion(**video_structure_request(content)):
+            yield "token", {"text": text}
+            for scene in parser.feed(text):
+                add_scene(scene)
+            while sent < len(scenes) and scenes[sent][1] is not None and scenes[sent][1].done():
+                yield "scene", await scene_event(sent)
+                sent += 1
+
+        if not parser.text:
+            raise ValueError("Failed to generate video data")
+        video_data = json.loads(parser.text)
+        for entry in scenes:
+            if entry[1] is None:
+                entry[1] = asyncio.ensure_future(find_image(image_query(video_data, entry[0])))
+        for index in range(sent, len(scenes)):
+            yield "scene", await scene_event(index)
+
+        video_data['scenes'] = [scene for scene, _ in scenes]
+        yield "video", VideoData(**video_data).model_dump()
+    finally:
+        for _, lookup in scenes:
+            if lookup is not None:
+                lookup.cancel()
+
 
-        function_call = response.choices[0].message.function_call
-        if function_call and function_call.arguments:
-            video_data = json.loads(function_call.arguments)
-            
-            for scene in video_data['scenes']:
-                image_query = scene.get('imageSearchKeyword', f"{video_data['title']} {scene['title']}")
-                image_url = search_image(image_query)
-                if image_url:
-                    scene['image'] = image_url
-            
-            return VideoData(**video_data)
-        else:
-            raise HTTPException(status_code=500, detail="Failed to generate video data")
+@router.post("/generate-video-data", response_model=VideoData)
+async def generate_video_data(
+    book_content: BookContent,
+    background: bool = False,
+    current_user: UserIdentity | None = Depends(get_optional_user)
+):
+    if background:
+        return await enqueue_job("pdf.generate_video_data", job_owner(current_user), book_content.content)
 
+    try:
+        video_data = await build_video_data(book_content.content)
+        return VideoData(**video_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+
+@router.post("/generate-video-data/stream")
+async def stream_generate_video_data(book_content: BookContent):
+    return sse_response(stream_video_data(book_content.content))
+
     
     
 prompt = """
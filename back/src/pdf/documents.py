@@ -0,0 +1,42 @@
+import asyncio
+
+from fastapi import HTTPException, status
+
+from ..app.cache import DiskLRU, extraction_cache
+from ..app.config import settings
+from .engine import iter_page_text, page_count
+
+# Bump when page text extraction changes so stale cache entries are ignored
+PAGES_VERSION = 1
+
+# Uploaded PDFs by SHA-256, so chapters and pages can be fetched after the upload
+document_store = DiskLRU(settings.document_store_dir, settings.document_store_max_bytes)
+
+
+async def store_document(upload):
+    await asyncio.to_thread(document_store.set_file, upload.digest, upload.path)
+
+
+async def document_path(digest):
+    path = await asyncio.to_thread(document_store.path, digest)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found, upload it again",
+        )
+    return path
+
+
+async def document_page_count(digest):
+    path = await document_path(digest)
+    return await asyncio.to_thread(page_count, path)
+
+
+async def page_range_text(digest, start, end):
+    """Text of pages ``start`` to ``end`` (1-based, inclusive) of a stored document."""
+    path = await document_path(digest)
+
+    async def extract():
+        return " ".join([" ".join(text.split()) async for text in iter_page_text(path, start - 1, end)])
+
+    return await extraction_cache.get_or_extract(f"pages:v{PAGES_VERSION}:{start}-{end}", digest, extract)
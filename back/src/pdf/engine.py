@@ -0,0 +1,163 @@
+import asyncio
+import math
+from collections import Counter, deque
+
+import fitz
+
+from ..app.config import settings
+from ..app.executor import pool_size, run_in_pool
+from ..app.metrics import count_work
+from .ocr import is_scanned, ocr_page_spans, ocr_page_text
+
+
+def page_count(path):
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def read_toc(path):
+    """Top-level ``(title, page)`` entries of the document's outline, read without parsing any page."""
+    with fitz.open(path) as doc:
+        toc = doc.get_toc()
+    if not toc:
+        return []
+    top_level = min(level for level, _, _ in toc)
+    return [(title.strip(), page) for level, title, page in toc if level == top_level and page >= 1]
+
+
+def page_ranges(start, stop, shard_pages):
+    return [(shard_start, min(shard_start + shard_pages, stop)) for shard_start in range(start, stop, shard_pages)]
+
+
+def page_spans(page, page_number):
+    # Image blocks would carry the image bytes, only text lines are used
+    blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)["blocks"]
+    if is_scanned(page, any(block.get("lines") for block in blocks)):
+        yield from ocr_page_spans(page, page_number)
+        return
+    for block in blocks:
+        for line in block.get("lines", ()):
+            for span in line["spans"]:
+                yield page_number, span["text"].strip(), span["size"], tuple(line["bbox"])
+
+
+def page_text(page):
+    # Pages without a text layer are scanned, their text comes from OCR
+    text = page.get_text()
+    return ocr_page_text(page) if is_scanned(page, text.strip()) else text
+
+
+def extract_text_range(path, start, stop):
+    """Text of pages ``start`` to ``stop`` (exclusive), one string per page."""
+    with fitz.open(path) as doc:
+        texts = [page_text(doc[number]) for number in range(start, stop)]
+    count_work("pdf_pages", stop - start)
+    return texts
+
+
+def extract_spans_range(path, start, stop, min_size=None):
+    """``(page_number, text, font_size, bbox)`` of every span on the pages, numbered from 1.
+
+    With ``min_size`` only spans set at least that large are returned.
+    """
+    with fitz.open(path) as doc:
+        spans = [
+            span
+            for number in range(start, stop)
+            for span in page_spans(doc[number], number + 1)
+            if min_size is None or span[2] >= min_size
+        ]
+    count_work("pdf_pages", stop - start)
+    return spans
+
+
+def font_scan_range(path, start, stop, heading_ratio=None, min_heading_size=None):
+    """Font-size histogram of the pages and their spans, from a single parse.
+
+    The histogram counts the characters set in each font size, and the number
+    of pages each size is used on. With ``heading_ratio``, only spans that can
+    be headings are kept. A heading is at least ``heading_ratio`` times the
+    body size, or at least ``min_heading_size`` when there is no clear heading
+    size. The body size of the whole document is not known yet, so this range's
+    own most common size stands in for it.
+
+    Returns ``(start, stop, characters, pages, min_size, spans)``. ``min_size``
+    is the smallest size kept, None when every span is kept.
+    """
+    characters = Counter()
+    pages = Counter()
+    spans = []
+    with fitz.open(path) as doc:
+        for number in range(start, stop):
+            sizes = set()
+            for span in page_spans(doc[number], number + 1):
+                _, text, font_size, _ = span
+                if text:
+                    size = round(font_size, 1)
+                    characters[size] += len(text)
+                    sizes.add(size)
+                spans.append(span)
+            pages.update(sizes)
+    count_work("pdf_pages", stop - start)
+
+    min_size = None
+    if heading_ratio is not None:
+        min_size = min_heading_size
+        if characters:
+            # Spans are compared rounded to 0.1
+            min_size = min(min_size, characters.most_common(1)[0][0] * heading_ratio - 0.05)
+        spans = [span for span in spans if span[2] >= min_size]
+    return start, stop, characters, pages, min_size, spans
+
+
+async def map_pages(func, path, start=0, stop=None, args=()):
+    """Run ``func(path, start, stop, *args)`` over page ranges in the process pool, yielding results in page order.
+
+    Up to one shard per pool worker is in flight, so a long document keeps every
+    core busy without queueing all of its shards at once. Shards of concurrent
+    documents wait for the same pool slots. Short documents are
+    split into smaller shards so they are spread over every core too.
+    """
+    if stop is None:
+        stop = await asyncio.to_thread(page_count, path)
+    shard_pages = max(1, min(settings.pdf_shard_pages, math.ceil((stop - start) / pool_size())))
+    shards = deque(page_ranges(start, stop, shard_pages))
+    running = deque()
+    try:
+        while shards or running:
+            while shards and len(running) < pool_size():
+                shard_start, shard_stop = shards.popleft()
+                running.append(asyncio.ensure_future(run_in_pool(func, path, shard_start, shard_stop, *args)))
+            yield await running.popleft()
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def iter_page_text(path, start=0, stop=None):
+    async for texts in map_pages(extract_text_range, path, start, stop):
+        for text in texts:
+            yield text
+
+
+async def font_scan(path, heading_ratio=None, min_heading_size=None):
+    """``font_scan_range`` over the whole document.
+
+    The histograms of the shards are merged. Returns ``(characters, pages, shards)``,
+    where ``shards`` holds ``(start, stop, min_size, spans)`` in page order.
+    """
+    characters = Counter()
+    pages = Counter()
+    shards = []
+    async for start, stop, shard_characters, shard_pages, min_size, spans in map_pages(
+        font_scan_range, path, args=(heading_ratio, min_heading_size)
+    ):
+        characters.update(shard_characters)
+        # Shards are disjoint page ranges, so their page counts add up
+        pages.update(shard_pages)
+        shards.append((start, stop, min_size, spans))
+    return characters, pages, shards
+
+
+async def extract_text(path):
+    return "\n".join([text async for text in iter_page_text(path)])
@@ -0,0 +1,79 @@
+import asyncio
+import os
+from collections import Counter
+
+import redis.asyncio as aioredis
+from unsplash.api import Api
+from unsplash.auth import Auth
+
+from ..app.cache import TTLCache, redis_client
+from ..app.config import settings
+from ..app.metrics import register_stats, stage_timer
+
+unsplash_auth = Auth(
+    os.environ.get("UNSPLASH_ACCESS_KEY"),
+    os.environ.get("UNSPLASH_SECRET_KEY"),
+    os.environ.get("UNSPLASH_REDIRECT_URI")
+)
+unsplash_api = Api(unsplash_auth)
+if settings.unsplash_base_url:
+    unsplash_api.base_url = settings.unsplash_base_url
+
+image_cache = TTLCache(settings.image_cache_max_entries, settings.image_cache_ttl)
+image_stats = Counter()
+register_stats("image_cache", image_stats, hit_ratio=True)
+
+_search_limit = asyncio.Semaphore(settings.image_search_concurrency)
+
+
+def search_image(query):
+    try:
+        results = unsplash_api.search.photos(query, per_page=1)
+        if results and results['results']:
+            return results['results'][0].urls.regular
+    except Exception as e:
+        print(f"Error searching for image: {e}")
+    return None
+
+
+def _cache_key(query):
+    return "unsplash:" + " ".join(query.lower().split())
+
+
+async def find_image(query):
+    key = _cache_key(query)
+    image_url = image_cache.get(key)
+    if image_url is not None:
+        image_stats["hits"] += 1
+        return image_url
+
+    try:
+        cached = await redis_client.get(key)
+    except aioredis.RedisError:
+        cached = None
+    if cached is not None:
+        image_url = cached.decode()
+        image_cache.set(key, image_url)
+        image_stats["hits"] += 1
+        return image_url
+
+    image_stats["misses"] += 1
+    async with _search_limit:
+        with stage_timer("unsplash"):
+            image_url = await asyncio.to_thread(search_image, query)
+
+    # Misses and errors are not cached so they are retried next time
+    if image_url:
+        image_cache.set(key, image_url)
+        try:
+            await redis_client.set(key, image_url, ex=settings.image_cache_ttl)
+        except aioredis.RedisError:
+            pass
+    return image_url
+
+
+async def find_images(queries):
+    """Resolve many queries at once, each distinct query is searched only once."""
+    unique_queries = list(dict.fromkeys(queries))
+    image_urls = await asyncio.gather(*(find_image(query) for query in unique_queries))
+    return dict(zip(unique_queries, image_urls))
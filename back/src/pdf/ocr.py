@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from statistics import median
+
+import fitz
+import pytesseract
+from PIL import Image
+
+from ..app.cache import extraction_cache
+from ..app.config import settings
+from ..app.metrics import count_work
+
+# Pages are already spread over the pool processes, one tesseract thread each
+# avoids oversubscribing the cores
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def otsu_threshold(histogram):
+    """Gray level that best separates ink from paper, from a 256-bin histogram."""
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = background_sum = 0
+    best_level, best_variance = 127, 0.0
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        background_sum += level * count
+        mean_difference = background_sum / background - (weighted_total - background_sum) / foreground
+        variance = background * foreground * mean_difference ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def preprocess(image):
+    """Downscale, grayscale and binarize an image before OCR."""
+    image = image.convert("L")
+    if max(image.size) > settings.ocr_max_dimension:
+        image.thumbnail((settings.ocr_max_dimension, settings.ocr_max_dimension), Image.LANCZOS)
+    threshold = otsu_threshold(image.histogram())
+    return image.point(lambda value: 255 if value > threshold else 0, "1")
+
+
+def is_scanned(page, has_text):
+    # A page with images but no text layer, blank pages are not worth OCR
+    return not has_text and bool(page.get_images())
+
+
+def render_page(page):
+    pixmap = page.get_pixmap(dpi=settings.ocr_dpi, colorspace=fitz.csGRAY)
+    return Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def ocr_page_text(page):
+    count_work("ocr_pages")
+    return pytesseract.image_to_string(preprocess(render_page(page)))
+
+
+def ocr_data(image):
+    # Chapter detection without an outline reads every page twice, the second
+    # read of a scanned page is served from the disk cache instead of OCR
+    key = "ocr:v1:" + hashlib.sha256(image.tobytes()).hexdigest()
+    cached = extraction_cache.disk.get(key)
+    if cached is not None:
+        return json.loads(cached)
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    extraction_cache.disk.set(key, json.dumps(data).encode())
+    return data
+
+
+def ocr_page_spans(page, page_number):
+    """Spans of a scanned page, shaped like PyMuPDF's, with the font size estimated from word heights."""
+    count_work("ocr_pages")
+    image = preprocess(render_page(page))
+    data = ocr_data(image)
+    # Pixels to PDF points, taking the downscaling into account
+    scale = page.rect.width / image.width
+
+    lines = {}
+    for index, word in enumerate(data["text"]):
+        if word.strip():
+            key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+            lines.setdefault(key, []).append(index)
+
+    for indexes in lines.values():
+        left = min(data["left"][i] for i in indexes)
+        top = min(data["top"][i] for i in indexes)
+        right = max(data["left"][i] + data["width"][i] for i in indexes)
+        bottom = max(data["top"][i] + data["height"][i] for i in indexes)
+        text = " ".join(data["text"][i].strip() for i in indexes)
+        size = median(data["height"][i] for i in indexes) * scale
+        yield page_number, text, size, (left * scale, top * scale, right * scale, bottom * scale)
+
+
+def ocr_image(path):
+    with Image.open(path) as image:
+        return pytesseract.image_to_string(preprocess(image))
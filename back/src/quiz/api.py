@@ -1,18 +1,19 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..app.db import get_async_db
+from ..app.schema import User as UserIdentity
 from ..auth.dependencies import get_current_user
-from .models import User
 from .schemas import QuizSummaryCreate, QuizSummaryResponse
-from .services import save_summary, summarize_text
+from .services import get_user_summaries, save_summary, summarize_text, update_profile_digest
 
 router = APIRouter()
 
 @router.post("/summarize", response_model=QuizSummaryResponse)
 async def summarize_quiz(
     summary_data: QuizSummaryCreate,
-    current_user: User = Depends(get_current_user),
+    background_tasks: BackgroundTasks,
+    current_user: UserIdentity = Depends(get_current_user),
     db: AsyncSession = Depends(get_async_db)
 ):
 
@@ -20,6 +21,18 @@ async def summarize_quiz(
         f"Q: {question}\nA: {answer}"
         for question, answer in zip(summary_data.questions, summary_data.answers)
     )
-    summary = await summarize_text(combined_text)
+    summary = await summarize_text(combined_text, current_user.id)
     saved_summary = await save_summary(db, current_user.id, summary)
-    return saved_summary
\ No newline at end of file
+    # The profile merge is another completion, the saved summary is returned without waiting for it
+    background_tasks.add_task(update_profile_digest, current_user.id, summary)
+    return saved_summary
+
+
+@router.get("/summaries", response_model=list[QuizSummaryResponse])
+async def list_summaries(
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: UserIdentity = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await get_user_summaries(db, current_user.id, limit, offset)
@@ -15,4 +15,12 @@ class QuizSummary(Base):
     user = relationship("User", back_populates="summaries")
 
 
+class UserProfileDigest(Base):
+    __tablename__ = "user_profile_digests"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    digest_text = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+
+
 User.summaries = relationship("QuizSummary", back_populates="user")
\ No newline at end of file
@@ -1,14 +1,36 @@
-import os
+import json
+import logging
 
-from openai import OpenAI
+import redis.asyncio as aioredis
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .models import QuizSummary
+from ..app.cache import redis_client
+from ..app.config import settings
+from ..app.db import AsyncSessionLocal
+from ..app.llm import create_chat_completion
+from ..multiformatsupport.chunking import clip_tokens
+from .models import QuizSummary, UserProfileDigest
 
-openai = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+logger = logging.getLogger(__name__)
 
+# Merges redone when other submissions keep updating the digest first
+PROFILE_MERGE_ATTEMPTS = 5
 
-async def summarize_text(text: str) -> str:
+# Caches a digest unless the cached one is already as new, so a slow reader
+# never puts back a digest an update has replaced
+_cache_newer_digest = redis_client.register_script("""
+local cached = redis.call('GET', KEYS[1])
+if cached and cjson.decode(cached)['version'] >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+""")
+
+
+async def summarize_text(text: str, user_id: int | None = None) -> str:
     messages = [
         {
             "role": "system",
@@ -20,7 +42,8 @@ async def summarize_text(text: str) -> str:
         }
     ]
 
-    response = openai.chat.completions.create(
+    response = await create_chat_completion(
+        user_id=user_id,
         model="gpt-4o-mini",
         messages=messages,
     )
@@ -29,6 +52,114 @@ async def summarize_text(text: str) -> str:
     return summary
 
 
+async def merge_profile_digest(digest_text: str, summary: str, user_id: int | None = None) -> str:
+    messages = [
+        {
+            "role": "system",
+            "content": "You maintain a compact profile of a learner, built from summaries of the quizzes they took. Keep what helps tailor future summaries to them: interests, preferred content types, strengths, gaps and level."
+        },
+        {
+            "role": "user",
+            "content": f"Current profile:\n{digest_text or '(empty)'}\n\nNew quiz summary:\n{summary}\n\nReturn the updated profile only, in at most {settings.profile_digest_tokens // 2} words."
+        }
+    ]
+
+    response = await create_chat_completion(
+        user_id=user_id,
+        model="gpt-4o-mini",
+        messages=messages,
+    )
+
+    return clip_tokens(response.choices[0].message.content.strip(), settings.profile_digest_tokens)
+
+
+async def cache_profile_digest(digest: UserProfileDigest):
+    try:
+        await _cache_newer_digest(
+            keys=[f"profile:{digest.user_id}"],
+            args=[
+                digest.version,
+                json.dumps({"version": digest.version, "digest": digest.digest_text}),
+                settings.profile_digest_ttl,
+            ],
+        )
+    except aioredis.RedisError:
+        pass
+
+
+async def update_profile_digest(user_id: int, summary: str):
+    """Merge a quiz summary into the user's profile digest, after the summary is saved.
+
+    No transaction or connection is held during the LLM merge. The result is
+    written only if ``version`` is still the one the merge started from,
+    otherwise another submission got there first and the merge is redone on
+    top of its digest.
+    """
+    try:
+        for _ in range(PROFILE_MERGE_ATTEMPTS):
+            async with AsyncSessionLocal() as db:
+                current = await db.get(UserProfileDigest, user_id)
+            version = current.version if current else 0
+            digest_text = await merge_profile_digest(current.digest_text if current else "", summary, user_id)
+
+            if current is None:
+                statement = (
+                    insert(UserProfileDigest)
+                    .values(user_id=user_id, digest_text=digest_text, version=1)
+                    .on_conflict_do_nothing(index_elements=[UserProfileDigest.user_id])
+                )
+            else:
+                statement = (
+                    update(UserProfileDigest)
+                    .where(UserProfileDigest.user_id == user_id, UserProfileDigest.version == version)
+                    .values(digest_text=digest_text, version=version + 1)
+                )
+            async with AsyncSessionLocal() as db:
+                written = (await db.execute(statement.returning(UserProfileDigest.version))).first()
+                await db.commit()
+
+            if written is not None:
+                await cache_profile_digest(UserProfileDigest(user_id=user_id, digest_text=digest_text, version=version + 1))
+                return
+        logger.warning("Profile digest of user %s kept changing, summary not merged", user_id)
+    except Exception:
+        # The quiz summary is already saved, only the profile misses this update
+        logger.exception("Could not merge a quiz summary into the profile of user %s", user_id)
+
+
+async def get_profile_digest(db: AsyncSession, user_id: int) -> str:
+    """The user's precomputed profile, one small read instead of their whole quiz history."""
+    try:
+        cached = await redis_client.get(f"profile:{user_id}")
+    except aioredis.RedisError:
+        cached = None
+    if cached is not None:
+        return json.loads(cached)["digest"]
+
+    digest = await db.get(UserProfileDigest, user_id)
+    if digest is not None:
+        await cache_profile_digest(digest)
+        return digest.digest_text
+
+    # Users whose quizzes predate digests start from their latest summary
+    query = select(QuizSummary.summary_text).where(QuizSummary.user_id == user_id).order_by(QuizSummary.id.desc()).limit(1)
+    result = await db.execute(query)
+    latest_summary = result.scalars().first()
+    return clip_tokens(latest_summary, settings.profile_digest_tokens) if latest_summary else ""
+
+
+async def get_user_summaries(db: AsyncSession, user_id: int, limit: int, offset: int) -> list[QuizSummary]:
+    query = (
+        select(QuizSummary)
+        .where(QuizSummary.user_id == user_id)
+        .order_by(QuizSummary.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )
+    result = await db.execute(query)
+    return list(result.scalars().all())
+
+
 async def save_summary(db: AsyncSession, user_id: int, summary: str) -> QuizSummary:
     new_summary = QuizSummary(user_id=user_id, summary_text=summary)
     db.add(new_summary)